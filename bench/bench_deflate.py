@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""\
+Compare compressing every broadcast frame per WebSocket connection, each
+with its own context, with compressing it once for all connections, for 1,
+10 and 100 viewers of a synthetic access log.  Every frame is inflated
+back as a browser would, with one context per connection.
+
+    python bench/bench_deflate.py [-l LINES] [-b BATCH]
+"""
+import os, sys
+import time
+import zlib
+import random
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'interface', 'http'))
+from wsframe import deflate, SYNC_TAIL
+
+
+LEVELS = ('INFO', 'INFO', 'INFO', 'DEBUG', 'WARN', 'ERROR')
+
+
+def make_payloads(count, batch, users=5000):
+    rnd = random.Random(42)
+    lines = []
+    for i in xrange(count):
+        lines.append('2012-03-04 12:%02d:%02d %s user%d GET /api/item/%d %d %dms' % (
+            i // 60 % 60, i % 60, rnd.choice(LEVELS), rnd.randrange(users),
+            rnd.randrange(100000), rnd.choice((200, 200, 304, 404, 500)),
+            rnd.randrange(2000)))
+    return ['\n'.join(lines[i:i + batch]) + '\n' for i in xrange(0, count, batch)]
+
+
+class Compressor(object):
+    """\
+    Context kept from one message to the next, like the compressor tornado
+    negotiates per connection.
+    """
+    def __init__(self):
+        self.c = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return (self.c.compress(data) + self.c.flush(zlib.Z_SYNC_FLUSH))[:-len(SYNC_TAIL)]
+
+
+def per_connection(payloads, viewers):
+    compressors = [Compressor() for i in xrange(viewers)]
+    out = [[] for i in xrange(viewers)]
+    for payload in payloads:
+        for i, c in enumerate(compressors):
+            out[i].append(deflate(payload, c))
+    return out
+
+
+def compress_once(payloads, viewers):
+    out = [[] for i in xrange(viewers)]
+    for payload in payloads:
+        data = deflate(payload)
+        for messages in out:
+            messages.append(data)
+    return out
+
+
+def inflate(messages):
+    d = zlib.decompressobj(-zlib.MAX_WBITS)
+    return [d.decompress(data + SYNC_TAIL) for data in messages]
+
+
+def run(func, payloads, viewers):
+    start = time.clock()
+    out = func(payloads, viewers)
+    elapsed = time.clock() - start
+    for messages in out:
+        assert inflate(messages) == payloads
+    return elapsed, sum(len(data) for data in out[0])
+
+
+def main():
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('-l', '--lines', dest='lines', default=50000, type='int',
+                      help='number of lines broadcast')
+    parser.add_option('-b', '--batch', dest='batch', default=100, type='int',
+                      help='lines per frame')
+    (options, args) = parser.parse_args()
+
+    payloads = make_payloads(options.lines, options.batch)
+    raw = sum(len(p) for p in payloads)
+    print '%d lines, %d frames, %d bytes per viewer' % (options.lines, len(payloads), raw)
+    print '%8s %14s %10s %14s %10s %8s' % ('viewers', 'per conn (s)', 'ratio',
+                                           'once (s)', 'ratio', 'speedup')
+    for viewers in (1, 10, 100):
+        slow, slow_bytes = run(per_connection, payloads, viewers)
+        fast, fast_bytes = run(compress_once, payloads, viewers)
+        print '%8d %14.4f %9.1fx %14.4f %9.1fx %7.1fx' % (
+            viewers, slow, raw / float(slow_bytes), fast, raw / float(fast_bytes),
+            slow / max(fast, 1e-9))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""\
+Compare FilterSet.select() with matching every LineFilter's regexes against
+every line, for 1, 10, 100 and 1000 keyword filters over a synthetic access
+log batch.
+
+    python bench/bench_filters.py [-l LINES] [-r REPEAT]
+"""
+import os, sys
+import time
+import random
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'interface', 'http'))
+from line_filter import LineFilter, FilterSet
+
+
+LEVELS = ('INFO', 'INFO', 'INFO', 'DEBUG', 'WARN', 'ERROR')
+
+
+def make_lines(count, users=5000):
+    rnd = random.Random(42)
+    lines = []
+    for i in xrange(count):
+        lines.append('2012-03-04 12:%02d:%02d %s user%d GET /api/item/%d %d %dms' % (
+            i // 60 % 60, i % 60, rnd.choice(LEVELS), rnd.randrange(users),
+            rnd.randrange(100000), rnd.choice((200, 200, 304, 404, 500)),
+            rnd.randrange(2000)))
+    return lines
+
+
+def make_filters(count):
+    """\
+    A viewer per user plus a few viewers on levels and status codes, the
+    last one with a regex include that cannot be prefiltered.
+    """
+    filters = [LineFilter('ERROR|WARN', 'healthcheck'), LineFilter(' 500 ')]
+    for i in xrange(count - 3):
+        filters.append(LineFilter('user%d ' % (i * 7)))
+    filters.append(LineFilter(r'\d{4}ms'))
+    return filters[:count]
+
+
+def naive_select(filters, lines):
+    return dict((f, f.filter(lines)) for f in filters)
+
+
+def timeit(func, repeat):
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def main():
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('-l', '--lines', dest='lines', default=20000, type='int',
+                      help='number of lines in the batch')
+    parser.add_option('-r', '--repeat', dest='repeat', default=3, type='int',
+                      help='best of REPEAT runs')
+    (options, args) = parser.parse_args()
+
+    lines = make_lines(options.lines)
+    print '%d lines' % len(lines)
+    print '%8s %12s %12s %12s %8s' % ('filters', 'naive (s)', 'compile (s)', 'select (s)', 'speedup')
+    for count in (1, 10, 100, 1000):
+        filters = make_filters(count)
+        naive, expected = timeit(lambda: naive_select(filters, lines), options.repeat)
+        compile, filter_set = timeit(lambda: FilterSet(filters), 1)
+        fast, result = timeit(lambda: filter_set.select(lines), options.repeat)
+        assert result == expected
+        print '%8d %12.6f %12.6f %12.6f %7.1fx' % (count, naive, compile, fast,
+                                                   naive / max(fast, 1e-9))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""\
+Compare Notifier.decode_events() with the per-event struct.unpack decoding
+loop it replaced, over synthetic inotify buffers.
+
+    python bench/bench_inotify_decode.py [-e EVENTS] [-r REPEAT]
+"""
+import os, sys
+import time
+import struct
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'interface', 'http'))
+import pyinotify
+
+
+class LegacyRawEvent(pyinotify._Event):
+    """_RawEvent as it was before the slotted version."""
+
+    def __init__(self, wd, mask, cookie, name):
+        self._str = None
+        d = {'wd': wd,
+             'mask': mask,
+             'cookie': cookie,
+             'name': name.rstrip('\0')}
+        pyinotify._Event.__init__(self, d)
+        pyinotify.log.debug(str(self))
+
+    def __str__(self):
+        if self._str is None:
+            self._str = pyinotify._Event.__str__(self)
+        return self._str
+
+
+def legacy_decode(r, coalesce, eventset):
+    events = []
+    queue_size = len(r)
+    rsum = 0
+    while rsum < queue_size:
+        s_size = 16
+        wd, mask, cookie, fname_len = struct.unpack('iIII',
+                                                    r[rsum:rsum+s_size])
+        fname, = struct.unpack('%ds' % fname_len,
+                               r[rsum + s_size:rsum + s_size + fname_len])
+        rawevent = LegacyRawEvent(wd, mask, cookie, fname)
+        if coalesce:
+            raweventstr = str(rawevent)
+            if raweventstr not in eventset:
+                eventset.add(raweventstr)
+                events.append(rawevent)
+        else:
+            events.append(rawevent)
+        rsum += s_size + fname_len
+    return events
+
+
+def make_buffer(count, watches=1000):
+    """\
+    Events as the kernel lays them out: a directory watch reports modified
+    files by name, names are NUL padded to a multiple of 16 bytes.
+    """
+    parts = []
+    for i in xrange(count):
+        name = 'worker-%04d.log' % (i % watches)
+        padded = name + '\0' * (16 - len(name) % 16)
+        parts.append(struct.pack('iIII', 1 + i % 8, pyinotify.IN_MODIFY, 0, len(padded)))
+        parts.append(padded)
+    return ''.join(parts)
+
+
+def make_notifier(coalesce):
+    notifier = pyinotify.Notifier.__new__(pyinotify.Notifier)
+    notifier._coalesce = coalesce
+    notifier._eventset = set()
+    return notifier
+
+
+def timeit(func, repeat):
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def main():
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('-e', '--events', dest='events', default=100000, type='int',
+                      help='number of events in the synthetic buffer')
+    parser.add_option('-r', '--repeat', dest='repeat', default=5, type='int',
+                      help='best of REPEAT runs')
+    (options, args) = parser.parse_args()
+
+    buf = make_buffer(options.events)
+    print '%d events, %d bytes' % (options.events, len(buf))
+    print '%10s %12s %12s %8s' % ('coalesce', 'legacy (s)', 'decode (s)', 'speedup')
+    for coalesce in (False, True):
+        legacy, expected = timeit(lambda: legacy_decode(buf, coalesce, set()), options.repeat)
+        fast, result = timeit(lambda: make_notifier(coalesce).decode_events(buf), options.repeat)
+        assert [(e.wd, e.mask, e.cookie, e.name) for e in result] == \
+               [(e.wd, e.mask, e.cookie, e.name) for e in expected]
+        print '%10s %12.6f %12.6f %7.1fx' % (coalesce, legacy, fast, legacy / max(fast, 1e-9))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""\
+Compare read_tail() with the char-by-char, seek-per-line tail it replaced.
+
+    python bench/bench_tail.py [-s SIZE_MB] [-n LINES] [-r REPEAT]
+"""
+import os, sys
+import time
+import tempfile
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'interface', 'http'))
+from tailer import Tailer
+
+
+class LegacyTailer(Tailer):
+    """The backward scan as it was before read_tail()."""
+
+    def seek_line(self):
+        pos = end_pos = self.file.tell()
+
+        read_size = self.read_size
+        if pos > read_size:
+            pos -= read_size
+        else:
+            pos = 0
+            read_size = end_pos
+
+        self.seek(pos)
+
+        bytes_read, read_str = self.read(read_size)
+
+        if bytes_read and read_str[-1] in self.line_terminators:
+            bytes_read -= 1
+            if read_str[-2:] == '\r\n' and '\r\n' in self.line_terminators:
+                bytes_read -= 1
+
+        while bytes_read > 0:
+            i = bytes_read - 1
+            while i >= 0:
+                if read_str[i] in self.line_terminators:
+                    self.seek(pos + i + 1)
+                    return self.file.tell()
+                i -= 1
+
+            if pos == 0 or pos - self.read_size < 0:
+                self.seek(0)
+                return None
+
+            pos -= self.read_size
+            self.seek(pos)
+
+            bytes_read, read_str = self.read(self.read_size)
+
+        return None
+
+    def tail(self, lines=10):
+        self.seek_end()
+        end_pos = self.file.tell()
+
+        for i in xrange(lines):
+            if not self.seek_line():
+                break
+
+        data = self.file.read(end_pos - self.file.tell() - 1)
+        if data:
+            return self.splitlines(data)
+        else:
+            return []
+
+
+def make_log(size):
+    fd, path = tempfile.mkstemp(suffix='.log')
+    f = os.fdopen(fd, 'w')
+    line = 0
+    written = 0
+    while written < size:
+        data = '2012-01-01 00:00:00,000 INFO [worker-%d] request %d served in %d ms\n' % (
+            line % 16, line, line % 997)
+        f.write(data)
+        written += len(data)
+        line += 1
+    f.close()
+    return path
+
+
+def timeit(func, repeat):
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def main():
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('-s', '--size', dest='size', default=64, type='int',
+                      help='size of the generated log in MB')
+    parser.add_option('-n', '--lines', dest='lines', default='10,1000,10000',
+                      help='comma separated list of line counts to tail')
+    parser.add_option('-r', '--repeat', dest='repeat', default=3, type='int',
+                      help='best of REPEAT runs')
+    (options, args) = parser.parse_args()
+
+    path = make_log(options.size * 1024 * 1024)
+    try:
+        f = open(path, 'rb')
+        print '%8s %12s %12s %8s' % ('lines', 'legacy (s)', 'block (s)', 'speedup')
+        for lines in [int(n) for n in options.lines.split(',')]:
+            legacy, expected = timeit(lambda: LegacyTailer(f).tail(lines), options.repeat)
+            block, result = timeit(lambda: Tailer(f).tail(lines), options.repeat)
+            assert result == expected, 'results differ for %d lines' % lines
+            print '%8d %12.6f %12.6f %7.1fx' % (lines, legacy, block, legacy / max(block, 1e-9))
+        f.close()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""\
+Follow a synthetic access log through a running server with viewers which
+negotiate permessage-deflate, and report what /metrics counted for their
+messages.  Fails if the server did not compress them.
+
+    python bench/bench_ws_compression.py [-l LINES] [-v VIEWERS] [-p PORT]
+"""
+import os, sys
+import json
+import time
+import shutil
+import tempfile
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'interface', 'http'))
+from tornado import gen, ioloop, websocket, httpclient
+import tornado_http
+from bench_deflate import make_payloads
+
+
+@gen.coroutine
+def follow(port, path, payloads, viewers):
+    url = 'ws://127.0.0.1:%d/websocket/tail/%s' % (port, os.path.basename(path))
+    conns = []
+    for i in xrange(viewers):
+        conn = yield websocket.websocket_connect(url, compression_options = {})
+        conns.append(conn)
+
+    f = open(path, 'a')
+    for payload in payloads:
+        f.write(payload)
+        f.flush()
+    f.close()
+
+    expected = sum(payload.count('\n') for payload in payloads)
+    for conn in conns:
+        received = 0
+        while received < expected:
+            msg = yield conn.read_message()
+            if msg is None:
+                raise RuntimeError('viewer disconnected after %d lines' % received)
+            received += msg.count('\n')
+        conn.close()
+
+    response = yield httpclient.AsyncHTTPClient().fetch(
+            'http://127.0.0.1:%d/metrics' % port)
+    raise gen.Return(json.loads(response.body))
+
+
+def main():
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('-l', '--lines', dest='lines', default=20000, type='int',
+                      help='number of lines appended')
+    parser.add_option('-v', '--viewers', dest='viewers', default=10, type='int',
+                      help='number of WebSocket viewers')
+    parser.add_option('-p', '--port', dest='port', default=18081, type='int',
+                      help='port of the test server')
+    (options, args) = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        path = os.path.join(root, 'access.log')
+        open(path, 'w').close()
+        tornado_http.BASIC_PATH = root
+        tornado_http.Application().listen(options.port, '127.0.0.1')
+
+        payloads = make_payloads(options.lines, 100)
+        start = time.time()
+        metrics = ioloop.IOLoop.current().run_sync(
+                lambda: follow(options.port, path, payloads, options.viewers), timeout = 600)
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(root)
+
+    stats = metrics['compression']
+    print '%d lines to %d viewers in %.2f s' % (options.lines, options.viewers, elapsed)
+    print '%d messages compressed, %d frames reused, %.4f s compressing' % (
+        stats['messages'], stats['frames_reused'], stats['cpu_seconds'])
+    print '%d payload bytes sent as %d (%.1fx)' % (
+        stats['bytes_in'], stats['bytes_out'],
+        stats['bytes_in'] / float(max(stats['bytes_out'], 1)))
+    if not stats['messages'] or stats['bytes_out'] >= stats['bytes_in']:
+        sys.exit('WebSocket messages were not compressed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""\
+In-memory catalog of the files under the basic path.
+
+The tree is walked once, then kept up to date from a recursive inotify
+watch: creations, deletions and moves are applied as they come, while
+IN_MODIFY only marks a file, and the marked files are stat()ed once per
+tick to update their size, mtime and growth rate.  Serving the catalog
+never touches the disk.
+"""
+
+import os
+import time
+
+import pyinotify
+from tornado.ioloop import IOLoop
+from tornado_pyinotify import WatchRegistry
+from line_index import SIDECAR_SUFFIX
+
+# inotify events the directories of the tree are watched for
+CATALOG_EVENTS = (pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+                  pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO |
+                  pyinotify.IN_MODIFY)
+# Seconds between two refreshes of the modified files
+CATALOG_INTERVAL = 1.0
+# Weight of the last interval in the growth rate
+RATE_SMOOTHING = 0.5
+
+
+class FileEntry(object):
+    __slots__ = ('size', 'mtime', 'rate')
+
+    def __init__(self, size, mtime):
+        self.size = size
+        self.mtime = mtime
+        # bytes per second, smoothed over the last intervals
+        self.rate = 0.0
+
+
+class FileCatalog(object):
+    """\
+    Listeners added with listen(callback) get callback(changed, removed)
+    after every tick which changed something: changed is a list of
+    describe() dicts, removed a list of names.
+    """
+    _instances = {}
+
+    @classmethod
+    def instance(cls, basic_path):
+        catalog = cls._instances.get(basic_path)
+        if catalog is None:
+            catalog = cls._instances[basic_path] = cls(basic_path, IOLoop.instance())
+            catalog.start()
+        return catalog
+
+    def __init__(self, basic_path, io_loop, interval=CATALOG_INTERVAL):
+        self.basic_path = os.path.normpath(basic_path)
+        self.io_loop = io_loop
+        self.interval = interval
+        # name relative to basic_path -> FileEntry
+        self.files = {}
+        # names modified since the last tick
+        self.dirty = set()
+        # names with a growth rate, refreshed every tick
+        self.active = set()
+        self.changed = set()
+        self.removed = set()
+        self.listeners = set()
+        self.last_tick = None
+
+    def start(self):
+        self.registry = WatchRegistry.instance()
+        self.registry.add_tree(self.basic_path, self.on_event, CATALOG_EVENTS)
+        self.scan(self.basic_path)
+        self.changed.clear()
+        self.last_tick = time.time()
+        self.io_loop.add_timeout(self.last_tick + self.interval, self.tick)
+
+    def listen(self, callback):
+        self.listeners.add(callback)
+
+    def unlisten(self, callback):
+        self.listeners.discard(callback)
+
+    def name(self, path):
+        return os.path.relpath(path, self.basic_path)
+
+    def scan(self, top):
+        """\
+        Add every file below top, a directory walk done at start and when a
+        directory is moved into the tree.
+        """
+        for root, dirs, files in os.walk(top):
+            for name in files:
+                self.update(os.path.join(root, name))
+
+    def update(self, path):
+        """\
+        stat() path into the catalog, return its entry.
+        """
+        if path.endswith(SIDECAR_SUFFIX) or path.endswith(SIDECAR_SUFFIX + '.tmp'):
+            return None
+        name = self.name(path)
+        try:
+            stats = os.stat(path)
+        except OSError:
+            self.remove(name)
+            return None
+
+        entry = self.files.get(name)
+        if entry is None:
+            entry = self.files[name] = FileEntry(stats.st_size, stats.st_mtime)
+        else:
+            entry.size = stats.st_size
+            entry.mtime = stats.st_mtime
+        self.changed.add(name)
+        self.removed.discard(name)
+        return entry
+
+    def remove(self, name):
+        if self.files.pop(name, None) is not None:
+            self.removed.add(name)
+        self.changed.discard(name)
+        self.dirty.discard(name)
+        self.active.discard(name)
+
+    def remove_tree(self, name):
+        prefix = name + os.sep
+        for other in [n for n in self.files if n.startswith(prefix)]:
+            self.remove(other)
+
+    def on_event(self, event):
+        mask = event.mask
+        name = self.name(event.pathname)
+        if event.dir:
+            if mask & (pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM):
+                self.remove_tree(name)
+            elif mask & pyinotify.IN_MOVED_TO:
+                # moved in from outside, nothing below it is watched yet
+                self.registry.add_tree(event.pathname, self.on_event, CATALOG_EVENTS)
+                self.scan(event.pathname)
+            # created directories are watched by auto_add, which also sends
+            # IN_CREATE for what is already in them
+        elif mask & (pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM):
+            self.remove(name)
+        elif mask & (pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO):
+            self.update(event.pathname)
+        elif mask & pyinotify.IN_MODIFY:
+            if name in self.files:
+                self.dirty.add(name)
+
+    def tick(self):
+        now = time.time()
+        elapsed = max(now - self.last_tick, 1e-3)
+        self.last_tick = now
+
+        for name in self.dirty | self.active:
+            entry = self.files.get(name)
+            if entry is None:
+                continue
+            size = entry.size
+            if name in self.dirty:
+                entry = self.update(os.path.join(self.basic_path, name))
+                if entry is None:
+                    continue
+            rate = max(entry.size - size, 0) / elapsed
+            entry.rate = RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * entry.rate
+            if entry.rate < 1:
+                entry.rate = 0.0
+                self.active.discard(name)
+            else:
+                self.active.add(name)
+            self.changed.add(name)
+        self.dirty.clear()
+
+        if self.changed or self.removed:
+            changed = [self.describe(name) for name in sorted(self.changed)]
+            removed = sorted(self.removed)
+            self.changed.clear()
+            self.removed.clear()
+            for callback in list(self.listeners):
+                callback(changed, removed)
+
+        self.io_loop.add_timeout(now + self.interval, self.tick)
+
+    def describe(self, name):
+        entry = self.files[name]
+        return {'name': name, 'size': entry.size, 'mtime': entry.mtime,
+                'rate': round(entry.rate, 1)}
+
+    def listing(self):
+        return [self.describe(name) for name in sorted(self.files)]
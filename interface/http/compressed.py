@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+"""\
+Read rotated logs compressed with gzip, bzip2 or xz as if they were plain
+files, without extracting them to disk.
+
+An archive is inflated once, ARCHIVE_CHUNK compressed bytes at a time, to
+learn its uncompressed size.  On the way an ArchiveIndex keeps restart
+points, copies of the zlib state every span uncompressed bytes, and the
+last TAIL_CACHE bytes of the data, so a later tail is served from memory
+and a seek only inflates from the closest restart point.  bz2 and lzma
+decompressors cannot be copied, their archives restart from the beginning.
+
+The index stays bounded: at most MAX_POINTS restart points per archive
+(the span doubles when they run out) and ARCHIVE_INDEXES archives indexed
+at a time.  Decompression reads INPUT_CHUNK compressed bytes at a time and
+gzip returns at most OUTPUT_CHUNK bytes per step.  The bz2 and lzma
+decompressors of Python 2 take no output limit, and feeding them less
+input does not help: a bz2 block of a few dozen bytes can expand to about
+45 MB.  A step of those formats returns whatever its input inflates to.
+"""
+
+import os
+import bz2
+import zlib
+from collections import OrderedDict
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# suffix -> format
+ARCHIVE_SUFFIXES = {
+    '.gz': 'gz',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+}
+# Compressed bytes read per decompress() call
+INPUT_CHUNK = 64 * 1024
+# Most uncompressed bytes a gzip decompress() call returns, bz2 and xz
+# calls are not limited
+OUTPUT_CHUNK = 256 * 1024
+# Compressed bytes inflated per ArchiveIndex.update() call
+ARCHIVE_CHUNK = 4 * 1024 * 1024
+# Initial uncompressed bytes between restart points, and most points kept
+CHECKPOINT_SPAN = 1024 * 1024
+MAX_POINTS = 64
+# Uncompressed bytes kept from the end of an archive
+TAIL_CACHE = 1024 * 1024
+# Archives indexed at a time, least recently used ones are dropped
+ARCHIVE_INDEXES = 8
+
+def archive_format(path):
+    """\
+    Return the compression format of path by its suffix, None for a plain
+    file.
+
+    >>> archive_format('/var/log/app.log.2.gz'), archive_format('app.log')
+    ('gz', None)
+    """
+    return ARCHIVE_SUFFIXES.get(os.path.splitext(path)[1])
+
+def is_archive(path):
+    return archive_format(path) is not None
+
+def new_decompressor(fmt):
+    if fmt == 'gz':
+        # 16 + MAX_WBITS: expect a gzip header and trailer
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif fmt == 'bz2':
+        return bz2.BZ2Decompressor()
+    elif fmt == 'xz':
+        if lzma is None:
+            raise IOError('reading .xz archives needs the lzma module')
+        return lzma.LZMADecompressor()
+    raise ValueError('unknown archive format %r' % fmt)
+
+def open_log(path):
+    """\
+    Open a log for reading, through an ArchiveFile if it is compressed.
+    """
+    if is_archive(path):
+        return ArchiveFile(path)
+    return open(path, 'r')
+
+def prepare(path, max_bytes=ARCHIVE_CHUNK):
+    """\
+    Index up to max_bytes more of path if it is an archive.
+
+    @return: True once reading the archive needs no full inflate anymore,
+             always True for plain files.
+    """
+    if not is_archive(path):
+        return True
+    index = get_archive_index(path)
+    if index.complete:
+        return True
+    f = open(path, 'rb')
+    try:
+        return index.update(f, max_bytes)
+    finally:
+        f.close()
+
+def iter_archive(path, raw=None):
+    """\
+    Generator of the uncompressed data of an archive, in pieces, inflated
+    straight from the start without touching the index.
+    """
+    f = raw or open(path, 'rb')
+    try:
+        decoder = _Decoder(archive_format(path), f, (0, 0, None))
+        while decoder.advance():
+            yield decoder.buf
+    finally:
+        if raw is None:
+            f.close()
+
+
+class _Decoder(object):
+    """\
+    Forward decompression of an archive from a restart point
+    (uncompressed offset, compressed offset, decompressor state).  buf holds
+    the last piece of data, starting at uncompressed offset buf_pos.
+    """
+    def __init__(self, fmt, raw, point):
+        self.fmt = fmt
+        self.raw = raw
+        self.buf_pos, self.in_pos, state = point
+        self.buf = ''
+        self.decompressor = state.copy() if state is not None else new_decompressor(fmt)
+        # input the decompressor has not consumed yet
+        self.pending = ''
+
+    def out_pos(self):
+        return self.buf_pos + len(self.buf)
+
+    def state(self):
+        """\
+        Return a restart point for the current position, None if the
+        decompressor cannot be copied or holds unconsumed input.
+        """
+        if self.fmt != 'gz' or self.pending:
+            return None
+        return (self.out_pos(), self.in_pos, self.decompressor.copy())
+
+    def advance(self):
+        """\
+        Replace buf with the next piece of data, return False at the end.
+        """
+        self.buf_pos += len(self.buf)
+        self.buf = ''
+        while not self.buf:
+            if self.pending:
+                data, self.pending = self.pending, ''
+            else:
+                self.raw.seek(self.in_pos)
+                data = self.raw.read(INPUT_CHUNK)
+                if not data:
+                    return False
+                self.in_pos += len(data)
+            self.buf = self.decompress(data)
+        return True
+
+    def decompress(self, data):
+        d = self.decompressor
+        try:
+            if self.fmt == 'gz':
+                out = d.decompress(data, OUTPUT_CHUNK)
+                self.pending = d.unconsumed_tail
+            else:
+                out = d.decompress(data)
+            rest = d.unused_data
+        except EOFError:
+            # bz2 and lzma refuse data after the end of their stream
+            out, rest = '', data
+
+        # the stream ended, what follows is another member (concatenated
+        # archives) or padding
+        rest = rest.lstrip('\0')
+        if rest:
+            self.decompressor = new_decompressor(self.fmt)
+            self.pending = rest
+        return out
+
+
+class ArchiveIndex(object):
+    def __init__(self, path):
+        self.path = path
+        self.fmt = archive_format(path)
+        self.reset()
+
+    def reset(self, stats=None):
+        # (uncompressed offset, compressed offset, decompressor state)
+        self.points = [(0, 0, None)]
+        self.span = CHECKPOINT_SPAN
+        # uncompressed size and last bytes, once complete
+        self.size = None
+        self.tail = ''
+        self.complete = False
+        self.stats = stats and (stats.st_ino, stats.st_size, stats.st_mtime)
+        self.builder = None
+        self.recent = []
+        self.recent_bytes = 0
+
+    def check(self, stats):
+        """\
+        Start over if the archive was replaced since it was indexed.
+        """
+        if (stats.st_ino, stats.st_size, stats.st_mtime) != self.stats:
+            self.reset(stats)
+
+    def update(self, file, max_bytes=ARCHIVE_CHUNK):
+        """\
+        Inflate up to max_bytes more compressed bytes of file.
+
+        @return: True once the whole archive is indexed.
+        """
+        self.check(os.fstat(file.fileno()))
+        if self.complete:
+            return True
+
+        if self.builder is None:
+            self.builder = _Decoder(self.fmt, file, self.points[0])
+        builder = self.builder
+        builder.raw = file
+        stop = builder.in_pos + max_bytes
+        while builder.in_pos < stop:
+            if not builder.advance():
+                self.finish()
+                return True
+
+            # the last TAIL_CACHE bytes, as a list of pieces
+            self.recent.append(builder.buf)
+            self.recent_bytes += len(builder.buf)
+            while self.recent_bytes - len(self.recent[0]) >= TAIL_CACHE:
+                self.recent_bytes -= len(self.recent.pop(0))
+
+            if builder.out_pos() - self.points[-1][0] >= self.span:
+                point = builder.state()
+                if point is not None:
+                    self.add_point(point)
+        return False
+
+    def add_point(self, point):
+        self.points.append(point)
+        if len(self.points) > MAX_POINTS:
+            # keep every other point, twice as far apart
+            self.points = self.points[::2]
+            self.span *= 2
+
+    def finish(self):
+        self.size = self.builder.out_pos()
+        self.tail = ''.join(self.recent)[-TAIL_CACHE:]
+        self.recent = []
+        self.recent_bytes = 0
+        self.builder = None
+        self.complete = True
+
+    def point_before(self, pos):
+        """\
+        Return the last restart point at or before uncompressed offset pos.
+        """
+        lo, hi = 0, len(self.points)
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self.points[mid][0] <= pos:
+                lo = mid
+            else:
+                hi = mid
+        return self.points[lo]
+
+
+# path -> ArchiveIndex, least recently used first
+archive_indexes = OrderedDict()
+
+def get_archive_index(path):
+    index = archive_indexes.pop(path, None)
+    if index is None:
+        index = ArchiveIndex(path)
+    archive_indexes[path] = index
+    while len(archive_indexes) > ARCHIVE_INDEXES:
+        archive_indexes.popitem(last=False)
+    return index
+
+
+class ArchiveFile(object):
+    """\
+    Read-only file object over the uncompressed data of an archive.  The
+    first seek relative to the end or read inflates the whole archive if
+    it is not indexed yet, see prepare().
+    """
+    def __init__(self, path):
+        self.path = path
+        self.raw = open(path, 'rb')
+        self.index = get_archive_index(path)
+        self.index.check(os.fstat(self.raw.fileno()))
+        self.pos = 0
+        self.decoder = None
+
+    @property
+    def closed(self):
+        return self.raw.closed
+
+    def fileno(self):
+        return self.raw.fileno()
+
+    def size(self):
+        index = self.index
+        while not index.update(self.raw):
+            pass
+        return index.size
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += self.size()
+        self.pos = max(pos, 0)
+
+    def read(self, size=-1):
+        end = self.size()
+        if size < 0 or self.pos + size > end:
+            size = end - self.pos
+        if size <= 0:
+            return ''
+
+        tail = self.index.tail
+        tail_start = end - len(tail)
+        if self.pos >= tail_start:
+            data = tail[self.pos - tail_start:self.pos - tail_start + size]
+        else:
+            data = self.inflate(size)
+        self.pos += len(data)
+        return data
+
+    def inflate(self, size):
+        decoder = self.decoder
+        point = self.index.point_before(self.pos)
+        if decoder is None or decoder.buf_pos > self.pos or decoder.out_pos() < point[0]:
+            # behind the position, or a restart point is closer
+            decoder = self.decoder = _Decoder(self.index.fmt, self.raw, point)
+
+        chunks = []
+        pos = self.pos
+        while size > 0:
+            offset = pos - decoder.buf_pos
+            if offset < len(decoder.buf):
+                piece = decoder.buf[offset:offset + size]
+                chunks.append(piece)
+                pos += len(piece)
+                size -= len(piece)
+            elif not decoder.advance():
+                break
+        return ''.join(chunks)
+
+    def readline(self):
+        chunks = []
+        while True:
+            data = self.read(4096)
+            if not data:
+                break
+            idx = data.find('\n')
+            if idx >= 0:
+                chunks.append(data[:idx + 1])
+                self.pos -= len(data) - idx - 1
+                break
+            chunks.append(data)
+        return ''.join(chunks)
+
+    def close(self):
+        self.decoder = None
+        self.raw.close()
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == '__main__':
+    _test()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""\
+Server side line filters of the tail subscribers.
+
+Subscribers asking for the same include/exclude patterns share one
+LineFilter, so every broadcast batch is matched once per distinct filter
+instead of once per subscriber.  A FilterSet goes further for the common
+keyword filters: the literals of every filter are compiled into a single
+trie shaped regex, each line is scanned once, and only the filters whose
+keywords occur in it are looked at.
+"""
+
+import re
+import weakref
+
+# (include, exclude) -> LineFilter, alive while a subscriber holds it
+_filters = weakref.WeakValueDictionary()
+
+_METACHARS = frozenset('.^$*+?{}[]\\|()')
+
+def literal_alternatives(pattern):
+    """\
+    Return the alternatives of pattern if it is made of '|' separated
+    literals only, None otherwise.
+
+    >>> literal_alternatives('ERROR|WARN')
+    ('ERROR', 'WARN')
+    >>> literal_alternatives('ERR(OR)?') is None
+    True
+    """
+    if not pattern:
+        return None
+    alternatives = tuple(pattern.split('|'))
+    for alternative in alternatives:
+        if not alternative or _METACHARS.intersection(alternative):
+            return None
+    return alternatives
+
+def trie_regex(literals):
+    """\
+    Return a regex matching any of the literals, shaped as their prefix trie
+    so that the regex engine follows a single branch at each position.
+
+    >>> trie_regex(['ERR', 'ERROR', 'WARN'])
+    '(?:ERR(?:OR)?|WARN)'
+    """
+    trie = {}
+    for literal in literals:
+        node = trie
+        for c in literal:
+            node = node.setdefault(c, {})
+        node[''] = None
+
+    def build(node):
+        branches = []
+        for c in sorted(node):
+            if c:
+                body = re.escape(c)
+                child = node[c]
+                # follow single child chains without nesting groups
+                while len(child) == 1 and '' not in child:
+                    c, child = child.items()[0]
+                    body += re.escape(c)
+                branches.append(body + build(child))
+        if not branches:
+            return ''
+        if len(branches) == 1:
+            body = branches[0]
+        else:
+            body = '(?:%s)' % '|'.join(branches)
+        if '' in node:
+            return '(?:%s)?' % body
+        return body
+
+    return build(trie)
+
+def get_filter(include=None, exclude=None):
+    """\
+    Return the shared LineFilter for the patterns, None if both are empty.
+
+    @raise re.error: a pattern does not compile.
+    """
+    include = include or None
+    exclude = exclude or None
+    if include is None and exclude is None:
+        return None
+
+    key = (include, exclude)
+    line_filter = _filters.get(key)
+    if line_filter is None:
+        line_filter = LineFilter(include, exclude)
+        _filters[key] = line_filter
+    return line_filter
+
+
+class LineFilter(object):
+    """\
+    Keeps the lines matching include (if given) and not matching exclude
+    (if given).
+
+    >>> f = LineFilter('ERROR|WARN', 'healthcheck')
+    >>> f.filter(['INFO ok', 'ERROR boom', 'WARN healthcheck slow'])
+    ['ERROR boom']
+    """
+    def __init__(self, include=None, exclude=None):
+        self.include = include
+        self.exclude = exclude
+        self.include_re = re.compile(include) if include else None
+        self.exclude_re = re.compile(exclude) if exclude else None
+        self.include_literals = literal_alternatives(include)
+        self.exclude_literals = literal_alternatives(exclude)
+
+    def match(self, line):
+        if self.include_re is not None and self.include_re.search(line) is None:
+            return False
+        if self.exclude_re is not None and self.exclude_re.search(line) is not None:
+            return False
+        return True
+
+    def filter(self, lines):
+        return [line for line in lines if self.match(line)]
+
+    def accepts(self, line, present):
+        """\
+        Like match(), for a FilterSet candidate: present holds the literals
+        of the set found in line, and a literal include is known to match.
+        """
+        if self.include_literals is None and self.include_re is not None:
+            if self.include_re.search(line) is None:
+                return False
+        if self.exclude_literals is not None:
+            if not present.isdisjoint(self.exclude_literals):
+                return False
+        elif self.exclude_re is not None and self.exclude_re.search(line) is not None:
+            return False
+        return True
+
+    def __repr__(self):
+        return '<LineFilter include=%r exclude=%r>' % (self.include, self.exclude)
+
+class FilterSet(object):
+    """\
+    Selects lines for several LineFilters with one scan of each line.
+
+    >>> errors, slow = LineFilter('ERROR'), LineFilter('slow|timeout', 'ERROR')
+    >>> selected = FilterSet([errors, slow]).select(
+    ...     ['INFO ok', 'ERROR timeout', 'WARN slow query'])
+    >>> selected[errors], selected[slow]
+    (['ERROR timeout'], ['WARN slow query'])
+    """
+    def __init__(self, filters):
+        self.filters = list(filters)
+        self.key = frozenset(self.filters)
+        # literal -> filters including lines which contain it
+        self.by_literal = {}
+        # filters which have to be looked at for every line
+        self.always = []
+
+        literals = set()
+        for line_filter in self.filters:
+            if line_filter.include_literals is None:
+                self.always.append(line_filter)
+            else:
+                for literal in line_filter.include_literals:
+                    self.by_literal.setdefault(literal, []).append(line_filter)
+                literals.update(line_filter.include_literals)
+            if line_filter.exclude_literals is not None:
+                literals.update(line_filter.exclude_literals)
+
+        self.matcher = None
+        if literals:
+            # the lookahead reports the longest literal starting at every
+            # position, the shorter ones it contains are added from
+            # self.contained
+            self.matcher = re.compile('(?=(%s))' % trie_regex(literals))
+        self.contained = dict((literal, [other for other in literals if other in literal])
+                              for literal in literals)
+
+    def present(self, line):
+        """\
+        Return the set of literals occurring in line.
+        """
+        found = self.matcher.findall(line)
+        present = set()
+        if found:
+            contained = self.contained
+            for literal in set(found):
+                present.update(contained[literal])
+        return present
+
+    def select(self, lines):
+        """\
+        Return {filter: lines it accepts} for every filter of the set.
+        """
+        if len(self.filters) == 1:
+            # nothing to share, its own regexes are faster than the scan
+            line_filter = self.filters[0]
+            return {line_filter: line_filter.filter(lines)}
+
+        selected = dict((line_filter, []) for line_filter in self.filters)
+        by_literal = self.by_literal
+        always = self.always
+        empty = frozenset()
+        for line in lines:
+            present = self.present(line) if self.matcher is not None else empty
+            if present:
+                candidates = set(always)
+                for literal in present:
+                    candidates.update(by_literal.get(literal, ()))
+            else:
+                candidates = always
+            for line_filter in candidates:
+                if line_filter.accepts(line, present):
+                    selected[line_filter].append(line)
+        return selected
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == '__main__':
+    _test()
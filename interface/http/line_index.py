@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""\
+Sparse index of line offsets, so any line range of a huge log can be read
+with one seek plus a short forward scan.
+
+The index records the byte offset of every step-th line.  It is built
+forward from the last indexed offset, either by update() reading the file
+or by feed() with the data a follower just read, and it is persisted in a
+sidecar file next to the log (or in a separate directory).
+"""
+
+import os
+import array
+
+# Lines between two recorded offsets
+INDEX_STEP = 1000
+# Bytes read per update() call when catching up with a file
+INDEX_CHUNK = 4 * 1024 * 1024
+# Sidecar suffix
+SIDECAR_SUFFIX = '.lidx'
+SIDECAR_MAGIC = 'lidx1'
+
+# path -> LineIndex, shared by the /lines handler and the followers
+indexes = {}
+
+def get_index(path, step=INDEX_STEP, sidecar_dir=None):
+    """\
+    Return the LineIndex of path, loading its sidecar file on first use.
+    """
+    index = indexes.get(path)
+    if index is None:
+        index = indexes[path] = LineIndex(path, step, sidecar_dir)
+        index.load()
+    return index
+
+def peek_index(path):
+    """\
+    Return the LineIndex of path if one was loaded, None otherwise.
+    """
+    return indexes.get(path)
+
+
+class LineIndex(object):
+    def __init__(self, path, step=INDEX_STEP, sidecar_dir=None):
+        self.path = path
+        self.step = step
+        if sidecar_dir:
+            name = path.strip(os.sep).replace(os.sep, '_')
+            self.sidecar = os.path.join(sidecar_dir, name + SIDECAR_SUFFIX)
+        else:
+            self.sidecar = path + SIDECAR_SUFFIX
+        self.reset()
+
+    def reset(self, ino=None):
+        # offsets[i] is the offset of line i * step, line 0 starts at 0
+        self.offsets = array.array('L', [0])
+        # complete lines seen before self.end
+        self.lines = 0
+        # offset up to which the file has been indexed
+        self.end = 0
+        self.ino = ino
+        self.dirty = True
+
+    def feed(self, data, offset):
+        """\
+        Index data read at offset.  Data which does not continue the indexed
+        part of the file is ignored, update() will catch up with it.
+        """
+        if offset != self.end or not data:
+            return False
+
+        step = self.step
+        pos = 0
+        while True:
+            need = step - self.lines % step
+            found = data.count('\n', pos)
+            if found < need:
+                self.lines += found
+                break
+            for i in xrange(need):
+                pos = data.index('\n', pos) + 1
+            self.lines += need
+            self.offsets.append(offset + pos)
+
+        self.end = offset + len(data)
+        self.dirty = True
+        return True
+
+    def update(self, file, max_bytes=INDEX_CHUNK):
+        """\
+        Index up to max_bytes of file from the last indexed offset.  The
+        index starts over if the file was replaced or truncated.
+
+        @return: True once the whole file is indexed.
+        """
+        ino = os.fstat(file.fileno()).st_ino
+        # seek / tell rather than fstat, so that an ArchiveFile reports its
+        # uncompressed size
+        file.seek(0, 2)
+        size = file.tell()
+        if ino != self.ino or size < self.end:
+            self.reset(ino)
+
+        remaining = max_bytes
+        while self.end < size and remaining > 0:
+            file.seek(self.end)
+            data = file.read(min(remaining, size - self.end))
+            if not data:
+                break
+            self.feed(data, self.end)
+            remaining -= len(data)
+        return self.end >= size
+
+    def lookup(self, line):
+        """\
+        Return (offset, line number) of the closest indexed line before line
+        (0 based).
+        """
+        i = min(line // self.step, len(self.offsets) - 1)
+        return self.offsets[i], i * self.step
+
+    def read_lines(self, file, first, count, read_size=64 * 1024):
+        """\
+        Return count lines starting at line first (0 based), with a single
+        seek to the closest indexed offset and a forward scan from there.
+        """
+        offset, line = self.lookup(first)
+        file.seek(offset)
+
+        result = []
+        buf = ''
+        while len(result) < count:
+            data = file.read(read_size)
+            if not data:
+                if buf and line >= first:
+                    result.append(buf)
+                break
+            buf += data
+            pos = 0
+            while len(result) < count:
+                idx = buf.find('\n', pos)
+                if idx < 0:
+                    break
+                if line >= first:
+                    result.append(buf[pos:idx].rstrip('\r'))
+                line += 1
+                pos = idx + 1
+            buf = buf[pos:]
+        return result
+
+    def load(self):
+        """\
+        Load the sidecar file, if it exists and matches the log.
+        """
+        try:
+            f = open(self.sidecar, 'rb')
+        except IOError:
+            return False
+        try:
+            header = f.readline().split()
+            if len(header) != 6 or header[0] != SIDECAR_MAGIC:
+                return False
+            step, ino, lines, end, count = [int(v) for v in header[1:]]
+            if step != self.step:
+                return False
+            offsets = array.array('L')
+            offsets.fromfile(f, count)
+        except (ValueError, EOFError):
+            return False
+        finally:
+            f.close()
+
+        self.offsets = offsets
+        self.ino = ino
+        self.lines = lines
+        self.end = end
+        self.dirty = False
+        return True
+
+    def save(self):
+        """\
+        Write the sidecar file if the index changed since the last save.
+        """
+        if not self.dirty:
+            return
+        tmp = self.sidecar + '.tmp'
+        try:
+            f = open(tmp, 'wb')
+            try:
+                f.write('%s %d %d %d %d %d\n' % (SIDECAR_MAGIC, self.step, self.ino or 0,
+                                                 self.lines, self.end, len(self.offsets)))
+                self.offsets.tofile(f)
+            finally:
+                f.close()
+            os.rename(tmp, self.sidecar)
+        except (IOError, OSError):
+            return
+        self.dirty = False
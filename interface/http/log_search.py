@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+"""\
+Search the whole history of a log with every core.
+
+The file is split into line aligned byte ranges, each range is searched by
+a worker of a multiprocessing pool over its own read-only mmap of the file,
+and the matching lines are handed back in file order as soon as the ranges
+before them are done.  Only a few ranges per worker are in flight at any
+time, so the results waiting for their turn stay bounded.  A search which
+is cancelled or hits its result limit stops submitting work and raises
+its flag in shared memory, which the workers check every CANCEL_CHECK
+bytes, so the ranges in flight stop soon too.
+
+A compressed archive cannot be split, it is a single range inflated as a
+stream by one worker.
+"""
+
+import os
+import re
+import mmap
+import multiprocessing
+
+from compressed import is_archive, iter_archive
+
+# Bytes per searched range
+SEARCH_CHUNK = 16 * 1024 * 1024
+# Ranges in flight per worker process
+SEARCH_WINDOW = 2
+# Searches running at a time which the workers can be told to stop, and
+# bytes a worker searches between two looks at the flag of its search
+SEARCH_SLOTS = 64
+CANCEL_CHECK = 1024 * 1024
+
+_pool = None
+_processes = 0
+# slot -> 1 once the search holding it stopped, shared with the workers
+_cancelled = None
+_free_slots = []
+
+def get_pool(processes=None):
+    """\
+    Return the process-wide search pool, created on first use with
+    processes workers (one per core if None).
+    """
+    global _pool, _processes, _cancelled
+    if _pool is None:
+        _processes = processes or multiprocessing.cpu_count()
+        _cancelled = multiprocessing.RawArray('b', SEARCH_SLOTS)
+        _free_slots.extend(range(SEARCH_SLOTS))
+        _pool = multiprocessing.Pool(_processes, _init_worker, (_cancelled,))
+    return _pool
+
+def _init_worker(cancelled):
+    global _cancelled
+    _cancelled = cancelled
+
+def is_cancelled(slot):
+    return slot is not None and _cancelled[slot]
+
+def compile_pattern(pattern):
+    """\
+    @raise re.error: the pattern does not compile.
+    """
+    return re.compile(pattern, re.M)
+
+def split_ranges(path, chunk_size=SEARCH_CHUNK):
+    """\
+    Return (start, end) offsets covering the file, every range but the last
+    one ends right after a line terminator.  An archive is a single
+    (0, None) range.
+    """
+    if is_archive(path):
+        return [(0, None)]
+
+    f = open(path, 'rb')
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return []
+        m = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+    try:
+        ranges = []
+        start = 0
+        while start < size:
+            idx = -1
+            if start + chunk_size < size:
+                idx = m.find('\n', start + chunk_size)
+            end = idx + 1 if idx >= 0 else size
+            ranges.append((start, end))
+            start = end
+        return ranges
+    finally:
+        m.close()
+
+# pattern -> compiled regex, per worker process
+_compiled = {}
+
+def search_buffer(regex, buf, start, end, limit, matches):
+    """\
+    Append to matches the lines of buf (a string or an mmap) starting in
+    [start, end) which regex matches, until there are limit.
+    """
+    pos = start
+    while len(matches) < limit:
+        match = regex.search(buf, pos, end)
+        if match is None:
+            break
+        idx = buf.rfind('\n', pos, match.start())
+        line_start = idx + 1 if idx >= 0 else pos
+        if line_start >= end:
+            break
+        line_end = buf.find('\n', match.start(), end)
+        if line_end < 0:
+            line_end = end
+        line = buf[line_start:line_end]
+        if line[-1:] == '\r':
+            line = line[:-1]
+        matches.append(line)
+        pos = line_end + 1
+    return matches
+
+def search_range(task):
+    """\
+    Pool worker: return (matching lines, error) for the lines starting in
+    [start, end), at most limit lines.  end is None for a whole archive.
+    The search of slot is checked for a cancellation between steps, the
+    lines found so far are returned if it was.
+    """
+    path, pattern, start, end, limit, slot = task
+    try:
+        regex = _compiled.get(pattern)
+        if regex is None:
+            regex = _compiled[pattern] = compile_pattern(pattern)
+
+        matches = []
+        if end is None:
+            partial = ''
+            for data in iter_archive(path):
+                if is_cancelled(slot):
+                    return matches, None
+                cut = data.rfind('\n')
+                if cut < 0:
+                    partial += data
+                    continue
+                buf = partial + data[:cut + 1]
+                partial = data[cut + 1:]
+                search_buffer(regex, buf, 0, len(buf), limit, matches)
+                if len(matches) >= limit:
+                    break
+            else:
+                search_buffer(regex, partial, 0, len(partial), limit, matches)
+            return matches, None
+
+        f = open(path, 'rb')
+        try:
+            m = mmap.mmap(f.fileno(), end, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        try:
+            pos = start
+            while pos < end and len(matches) < limit and not is_cancelled(slot):
+                step_end = end
+                if pos + CANCEL_CHECK < end:
+                    idx = m.find('\n', pos + CANCEL_CHECK, end)
+                    if idx >= 0:
+                        step_end = idx + 1
+                search_buffer(regex, m, pos, step_end, limit, matches)
+                pos = step_end
+            return matches, None
+        finally:
+            m.close()
+    except Exception, e:
+        # the file shrank or went away under the search, or an archive is
+        # corrupt; Pool.apply_async() would never call back on a raise
+        return [], str(e)
+
+
+class ParallelSearch(object):
+    """\
+    One search of a file.  on_lines(lines) gets the matching lines of each
+    range in file order, on_done(message) is called once at the end with
+    None, or with why the search stopped early.
+
+    The callbacks run on io_loop; the pool result thread only hands the
+    results over with io_loop.add_callback().
+    """
+    def __init__(self, path, pattern, limit, on_lines, on_done, io_loop,
+                 chunk_size=SEARCH_CHUNK, processes=None):
+        self.path = path
+        self.pattern = pattern
+        self.limit = limit
+        self.on_lines = on_lines
+        self.on_done = on_done
+        self.io_loop = io_loop
+        self.chunk_size = chunk_size
+        self.pool = get_pool(processes)
+        self.window = _processes * SEARCH_WINDOW
+
+        self.ranges = []
+        self.submitted = 0
+        self.emitted = 0
+        # range number -> result, waiting for the ranges before it
+        self.results = {}
+        self.found = 0
+        self.finished = False
+        # ranges submitted which did not call back yet
+        self.in_flight = 0
+        # flag of this search in _cancelled, None if all are taken
+        self.slot = None
+
+    def start(self):
+        """\
+        @raise re.error: the pattern does not compile.
+        @raise IOError: the file cannot be read.
+        """
+        compile_pattern(self.pattern)
+        self.ranges = split_ranges(self.path, self.chunk_size)
+        if _free_slots:
+            self.slot = _free_slots.pop()
+            _cancelled[self.slot] = 0
+        self.submit()
+
+    def cancel(self):
+        """\
+        Stop submitting ranges and tell the workers to stop the ranges in
+        flight, their results are dropped.
+        """
+        self.finished = True
+        self.stop()
+
+    def stop(self):
+        if self.slot is None:
+            return
+        _cancelled[self.slot] = 1
+        if not self.in_flight:
+            # no worker looks at the flag anymore
+            _free_slots.append(self.slot)
+            self.slot = None
+
+    def submit(self):
+        while (self.submitted < len(self.ranges) and
+               self.submitted - self.emitted < self.window):
+            number = self.submitted
+            start, end = self.ranges[number]
+            task = (self.path, self.pattern, start, end, self.limit - self.found,
+                    self.slot)
+            self.pool.apply_async(search_range, (task,),
+                                  callback=lambda result, number=number:
+                                      self.io_loop.add_callback(
+                                          lambda: self.on_result(number, result)))
+            self.submitted += 1
+            self.in_flight += 1
+
+        if self.emitted == len(self.ranges):
+            self.finish(None)
+
+    def on_result(self, number, result):
+        self.in_flight -= 1
+        if self.finished:
+            self.stop()
+            return
+        self.results[number] = result
+
+        while self.emitted in self.results:
+            lines, error = self.results.pop(self.emitted)
+            self.emitted += 1
+            if error is not None:
+                self.finish(error)
+                return
+
+            lines = lines[:self.limit - self.found]
+            self.found += len(lines)
+            if lines:
+                self.on_lines(lines)
+            if self.found >= self.limit:
+                self.finish('search stopped at %d matches' % self.found)
+                return
+
+        self.submit()
+
+    def finish(self, message):
+        if self.finished:
+            return
+        self.finished = True
+        self.results.clear()
+        self.stop()
+        self.on_done(message)
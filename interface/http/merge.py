@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""\
+Merge the lines of several followed logs into one timeline.
+
+Lines are ordered by their parsed timestamp in a single heap shared by all
+sources.  A line is held back until the newest timestamp seen is window
+seconds past it, so lines of a slower source can still be put in front of
+it, or until the sources went quiet for a tick.  The heap never holds more
+than max_pending lines whatever the number of sources: past that the
+oldest lines are released early.
+"""
+
+import heapq
+
+# Seconds of log time a line waits for older lines of other sources
+MERGE_WINDOW = 2.0
+# Most lines held back for reordering
+MERGE_MAX_PENDING = 10000
+
+
+class TimelineMerger(object):
+    """\
+    >>> from time_index import TimestampParser
+    >>> parser = TimestampParser('%H:%M:%S')
+    >>> merger = TimelineMerger(window=1)
+    >>> merger.push('a', parser, ['10:00:00 a1', '10:00:03 a2'])
+    >>> merger.push('b', parser, ['10:00:01 b1', '  b1 continued', '10:00:02 b2'])
+    >>> merger.ready()
+    [('a', '10:00:00 a1'), ('b', '10:00:01 b1'), ('b', '  b1 continued'), ('b', '10:00:02 b2')]
+    >>> merger.ready(drain=True)
+    [('a', '10:00:03 a2')]
+    """
+    def __init__(self, window=MERGE_WINDOW, max_pending=MERGE_MAX_PENDING):
+        self.window = window
+        self.max_pending = max_pending
+        # (time, arrival number, source, line)
+        self.heap = []
+        self.seq = 0
+        # newest timestamp seen
+        self.high_water = None
+        # source -> timestamp of its last stamped line, for the lines
+        # without one (stack traces, continuations)
+        self.last_stamp = {}
+        self.arrived = False
+
+    def push(self, source, parser, lines):
+        heap = self.heap
+        stamp = self.last_stamp.get(source)
+        for line in lines:
+            parsed = parser.parse(line)
+            if parsed is not None:
+                stamp = parsed
+                if self.high_water is None or stamp > self.high_water:
+                    self.high_water = stamp
+            elif stamp is None:
+                # nothing to order it by yet, take it as current
+                stamp = self.high_water or 0
+            heapq.heappush(heap, (stamp, self.seq, source, line))
+            self.seq += 1
+        self.last_stamp[source] = stamp
+        if lines:
+            self.arrived = True
+
+    def forget(self, source):
+        """\
+        Drop the lines held back for source and what is known about it,
+        once it is not followed anymore.
+
+        >>> from time_index import TimestampParser
+        >>> merger = TimelineMerger(window=1)
+        >>> merger.push('a', TimestampParser('%H:%M:%S'), ['10:00:00 a1'])
+        >>> merger.push('b', TimestampParser('%H:%M:%S'), ['10:00:00 b1'])
+        >>> merger.forget('a')
+        >>> merger.ready(drain=True), merger.last_stamp.keys()
+        ([('b', '10:00:00 b1')], ['b'])
+        """
+        self.last_stamp.pop(source, None)
+        kept = [entry for entry in self.heap if entry[2] is not source]
+        if len(kept) != len(self.heap):
+            heapq.heapify(kept)
+            self.heap = kept
+
+    def trim(self, count):
+        """\
+        Drop all but the newest count lines.
+        """
+        heap = self.heap
+        while len(heap) > count:
+            heapq.heappop(heap)
+
+    def ready(self, drain=False):
+        """\
+        Pop the (source, line) which no line can overtake anymore, in time
+        order, or every line if drain.
+        """
+        heap = self.heap
+        limit = None
+        if self.high_water is not None:
+            limit = self.high_water - self.window
+        result = []
+        while heap and (drain or len(heap) > self.max_pending or
+                        (limit is not None and heap[0][0] <= limit)):
+            stamp, seq, source, line = heapq.heappop(heap)
+            result.append((source, line))
+        return result
+
+    def tick(self):
+        """\
+        To be called every window seconds: pop what is ready, everything if
+        no line arrived since the previous tick.
+        """
+        drain = not self.arrived
+        self.arrived = False
+        return self.ready(drain)
+
+    def __len__(self):
+        return len(self.heap)
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == '__main__':
+    _test()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""\
+Bounded output queues of the viewers.
+
+Lines go straight to the connection while its write buffer is below the
+limit.  Past it they wait in the viewer's OutputQueue, which never holds
+more than limit bytes: when full it drops its oldest lines, thins itself
+out by keeping every other line, or asks for the viewer to be
+disconnected, depending on the policy.  The viewer is told how many lines
+it missed by a marker line in front of what is sent next.
+"""
+
+import weakref
+from collections import deque
+
+POLICIES = ('drop-oldest', 'sample', 'disconnect')
+
+# totals since the server started
+metrics = {
+    'lines_dropped': 0,
+    'disconnects': 0,
+}
+# live queues, for snapshot()
+_queues = weakref.WeakSet()
+
+def snapshot():
+    """\
+    Return the metrics, with the current depth of the queues.
+    """
+    queues = list(_queues)
+    result = dict(metrics)
+    result['queues'] = len(queues)
+    result['queued_lines'] = sum(len(q) for q in queues)
+    result['queued_bytes'] = sum(q.bytes for q in queues)
+    result['max_queued_bytes'] = max([q.bytes for q in queues] or [0])
+    return result
+
+def buffered_bytes(stream):
+    """\
+    Bytes written to an IOStream which did not reach the socket yet.  The
+    write buffer is private to tornado: a deque of chunks up to 4.4, a
+    bytearray with a _write_buffer_size in 4.5 and a _StreamBuffer whose
+    len() counts bytes since 5.0.
+
+    >>> class Stream(object): pass
+    >>> stream = Stream()
+    >>> stream._write_buffer = deque(['abc', 'de'])
+    >>> buffered_bytes(stream)
+    5
+    >>> stream._write_buffer = bytearray('abc')
+    >>> buffered_bytes(stream)
+    3
+    """
+    size = getattr(stream, '_write_buffer_size', None)
+    if size is not None:
+        return size
+    buf = getattr(stream, '_write_buffer', None)
+    if buf is None:
+        return 0
+    if isinstance(buf, (deque, list)):
+        return sum(len(chunk) for chunk in buf)
+    return len(buf)
+
+
+class OutputQueue(object):
+    """\
+    >>> q = OutputQueue(10, 'drop-oldest')
+    >>> q.put(['aaa', 'bbb', 'ccc', 'ddd'])
+    True
+    >>> q.take()
+    ['-- 2 lines skipped --', 'ccc', 'ddd']
+    >>> OutputQueue(10, 'disconnect').put(['a' * 20])
+    False
+    """
+    def __init__(self, limit, policy='drop-oldest'):
+        if policy not in POLICIES:
+            raise ValueError('unknown slow client policy %r' % policy)
+        self.limit = limit
+        self.policy = policy
+        self.lines = deque()
+        self.bytes = 0
+        # lines dropped since the last take()
+        self.skipped = 0
+        # Batch of the queued lines: range from the start of the first one
+        # to the end of the last one, and number of the last one
+        self.batch = None
+        _queues.add(self)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def put(self, lines, batch = None):
+        """\
+        Queue lines, from batch if known, return False if the client has to
+        be disconnected.
+        """
+        if batch is not None:
+            if self.batch is None:
+                self.batch = batch
+            else:
+                self.batch = self.batch._replace(seq = batch.seq, end = batch.end)
+        self.lines.extend(lines)
+        self.bytes += sum(len(line) + 1 for line in lines)
+        if self.bytes <= self.limit:
+            return True
+
+        if self.policy == 'disconnect':
+            metrics['disconnects'] += 1
+            self.clear()
+            return False
+
+        before = len(self.lines)
+        if self.policy == 'sample':
+            while self.bytes > self.limit and len(self.lines) > 1:
+                self.lines = deque(list(self.lines)[1::2])
+                self.bytes = sum(len(line) + 1 for line in self.lines)
+        while self.bytes > self.limit and self.lines:
+            self.bytes -= len(self.lines.popleft()) + 1
+        dropped = before - len(self.lines)
+        self.skipped += dropped
+        metrics['lines_dropped'] += dropped
+        return True
+
+    def take(self, marker = True):
+        """\
+        Return the queued lines, behind a marker if lines were dropped and
+        marker is true, and empty the queue.
+        """
+        lines = list(self.lines)
+        if self.skipped and marker:
+            lines.insert(0, '-- %d lines skipped --' % self.skipped)
+        self.clear()
+        return lines
+
+    def clear(self):
+        self.lines.clear()
+        self.bytes = 0
+        self.skipped = 0
+        self.batch = None
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == '__main__':
+    _test()
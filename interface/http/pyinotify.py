@@ -99,6 +99,9 @@ __metaclass__ = type  # Use new-style classes by default
 # function compatibility_mode() instead.
 COMPATIBILITY_MODE = False
 
+# struct inotify_event header: wd, mask, cookie, len (of name)
+_EVENT_HEADER = struct.Struct('iIII')
+
 
 class InotifyBindingNotFoundError(PyinotifyError):
     """
@@ -535,11 +538,14 @@ class _Event:
         return repr(self)
 
 
-class _RawEvent(_Event):
+class _RawEvent:
     """
     Raw event, it contains only the informations provided by the system.
-    It doesn't infer anything.
+    It doesn't infer anything. One of these is built for every event read
+    from the kernel, hence the slots and the absence of debug logging.
     """
+    __slots__ = ('wd', 'mask', 'cookie', 'name')
+
     def __init__(self, wd, mask, cookie, name):
         """
         @param wd: Watch Descriptor.
@@ -554,21 +560,20 @@ class _RawEvent(_Event):
                      on the watched item itself.
         @type name: string or None
         """
-        # Use this variable to cache the result of str(self), this object
-        # is immutable.
-        self._str = None
+        self.wd = wd
+        self.mask = mask
+        self.cookie = cookie
         # name: remove trailing '\0'
-        d = {'wd': wd,
-             'mask': mask,
-             'cookie': cookie,
-             'name': name.rstrip('\0')}
-        _Event.__init__(self, d)
-        log.debug(str(self))
+        self.name = name.rstrip('\0')
+
+    def __repr__(self):
+        return repr(_Event({'wd': self.wd,
+                            'mask': self.mask,
+                            'cookie': self.cookie,
+                            'name': self.name})).replace('_Event', '_RawEvent', 1)
 
     def __str__(self):
-        if self._str is None:
-            self._str = _Event.__str__(self)
-        return self._str
+        return repr(self)
 
 
 class Event(_Event):
@@ -1166,7 +1171,7 @@ class Notifier:
         self._timeout = timeout
         # Coalesce events option
         self._coalesce = False
-        # set of str(raw_event), only used when coalesce option is True
+        # set of (wd, mask, cookie, name), only used when coalesce option is True
         self._eventset = set()
 
     def append_event(self, event):
@@ -1252,25 +1257,45 @@ class Notifier:
         except Exception, msg:
             raise NotifierError(msg)
         log.debug('Event queue size: %d', queue_size)
+        self._eventq.extend(self.decode_events(r))
+
+    def decode_events(self, r):
+        """
+        Decode a buffer read from the inotify fd in a single pass.
+
+        @param r: Content read from the inotify fd.
+        @type r: str
+        @return: Decoded events, without the doublons of this batch if
+                 the coalescing option is enabled.
+        @rtype: list of _RawEvent
+        """
+        unpack_from = _EVENT_HEADER.unpack_from
+        s_size = _EVENT_HEADER.size
+        coalesce = self._coalesce
+        eventset = self._eventset
+        events = []
+        append = events.append
         rsum = 0  # counter
-        while rsum < queue_size:
-            s_size = 16
+        end = len(r)
+        while rsum < end:
             # Retrieve wd, mask, cookie and fname_len
-            wd, mask, cookie, fname_len = struct.unpack('iIII',
-                                                        r[rsum:rsum+s_size])
+            wd, mask, cookie, fname_len = unpack_from(r, rsum)
+            rsum += s_size
             # Retrieve name
-            fname, = struct.unpack('%ds' % fname_len,
-                                   r[rsum + s_size:rsum + s_size + fname_len])
+            if fname_len:
+                fname = r[rsum:rsum + fname_len]
+                rsum += fname_len
+            else:
+                fname = ''
             rawevent = _RawEvent(wd, mask, cookie, fname)
-            if self._coalesce:
+            if coalesce:
                 # Only enqueue new (unique) events.
-                raweventstr = str(rawevent)
-                if raweventstr not in self._eventset:
-                    self._eventset.add(raweventstr)
-                    self._eventq.append(rawevent)
-            else:
-                self._eventq.append(rawevent)
-            rsum += s_size + fname_len
+                key = (wd, mask, cookie, rawevent.name)
+                if key in eventset:
+                    continue
+                eventset.add(key)
+            append(rawevent)
+        return events
 
     def process_events(self):
         """
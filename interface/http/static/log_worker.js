@@ -0,0 +1,179 @@
+// Web Worker of the log panel in tmpl/index.html.  It decodes the
+// WebSocket messages, splits them into lines, marks the highlighted spans
+// and searches the lines kept for scrolling back, so the page only stores
+// the batches it gets back and renders the rows in view.
+//
+// Lines are numbered from the first one received.  Each batch goes back as
+// {type: 'rows', count, bytes, offsets, marks, fileId, end}: line i of the
+// batch is bytes[offsets[2i]:offsets[2i + 1]] in UTF-8, marks holds
+// (line number, start, end) triples of the highlighted UTF-16 spans, and
+// fileId / end tell where a reconnect resumes.  The buffers are
+// transferred, the bytes of a binary message are handed back as they came.
+//
+// Messages to the worker:
+//   {type: 'reset'}                   a new file is followed
+//   {type: 'connect'}                 a new connection, batch numbers restart
+//   {type: 'data', data}              a WebSocket message, or a notice
+//   {type: 'highlight', pattern}      answered with {type: 'marks', marks}
+//   {type: 'find', pattern, from}     answered with {type: 'found', index},
+//                                     index -1 if no kept line matches
+
+// Lines kept for search, as many as the panel keeps
+var SCROLLBACK = 100000;
+// binary batch header (wsframe.py): file id, batch number, start and end
+// offsets, line count and skipped lines
+var HEADER_SIZE = 32;
+
+var decoder = new TextDecoder("utf-8");
+var encoder = new TextEncoder();
+
+var lines = new Array(SCROLLBACK);
+var total = 0;
+var highlight = null;
+// file id, number and end offset of the last batch
+var fileId = null;
+var seq = 0;
+var end = 0;
+
+var oldest = function() {
+    return Math.max(total - SCROLLBACK, 0);
+};
+
+var compile = function(pattern, flags) {
+    if(!pattern) {
+        return null;
+    }
+    try {
+        return new RegExp(pattern, flags);
+    }
+    catch(e) {
+        return null;
+    }
+};
+
+// push (line number, start, end) of the highlighted spans of lines
+// [from, to) to out
+var mark = function(from, to, out) {
+    if(highlight === null) {
+        return out;
+    }
+    for(var n = from; n < to; n++) {
+        var line = lines[n % SCROLLBACK];
+        var m;
+        highlight.lastIndex = 0;
+        while((m = highlight.exec(line)) !== null) {
+            if(m[0].length === 0) {
+                highlight.lastIndex += 1;
+                continue;
+            }
+            out.push(n, m.index, m.index + m[0].length);
+        }
+    }
+    return out;
+};
+
+var post = function(batch, bytes, offsets) {
+    var first = total;
+    for(var i = 0; i < batch.length; i++) {
+        lines[(first + i) % SCROLLBACK] = batch[i];
+    }
+    total += batch.length;
+    var marks = new Uint32Array(mark(first, total, []));
+    postMessage({'type' : 'rows', 'count' : batch.length, 'bytes' : bytes,
+                 'offsets' : offsets, 'marks' : marks, 'fileId' : fileId, 'end' : end},
+                [bytes.buffer, offsets.buffer, marks.buffer]);
+};
+
+// newline terminated lines of a text message
+var postText = function(text) {
+    var bytes = encoder.encode(text);
+    var starts = [0];
+    for(var i = 0; i < bytes.length; i++) {
+        if(bytes[i] === 10) {
+            starts.push(i + 1);
+        }
+    }
+    if(starts[starts.length - 1] !== bytes.length) {
+        starts.push(bytes.length + 1);
+    }
+    var count = starts.length - 1;
+    var offsets = new Uint32Array(count * 2);
+    var batch = new Array(count);
+    for(var n = 0; n < count; n++) {
+        offsets[2 * n] = starts[n];
+        offsets[2 * n + 1] = starts[n + 1] - 1;
+        batch[n] = decoder.decode(bytes.subarray(starts[n], starts[n + 1] - 1));
+    }
+    if(count) {
+        post(batch, bytes, offsets);
+    }
+};
+
+var postBinary = function(buffer) {
+    var view = new DataView(buffer);
+    var id = view.getUint32(0);
+    var number = view.getUint32(4);
+    if(id === fileId && number !== 0 && number <= seq) {
+        // already shown
+        return;
+    }
+    seq = id === fileId ? Math.max(seq, number) : number;
+    fileId = id;
+    end = view.getUint32(16) * 4294967296 + view.getUint32(20);
+    var count = view.getUint32(24);
+    var skipped = view.getUint32(28);
+    if(skipped) {
+        postText('-- ' + skipped + ' lines skipped --\n');
+    }
+
+    var bytes = new Uint8Array(buffer);
+    var offsets = new Uint32Array(count * 2);
+    var batch = new Array(count);
+    var pos = HEADER_SIZE + count * 4;
+    for(var i = 0; i < count; i++) {
+        var len = view.getUint32(HEADER_SIZE + i * 4);
+        offsets[2 * i] = pos;
+        offsets[2 * i + 1] = pos + len;
+        batch[i] = decoder.decode(bytes.subarray(pos, pos + len));
+        pos += len;
+    }
+    post(batch, bytes, offsets);
+};
+
+onmessage = function(evt) {
+    var msg = evt.data;
+    if(msg.type === 'data') {
+        if(typeof msg.data === "string") {
+            postText(msg.data);
+        }
+        else {
+            postBinary(msg.data);
+        }
+    }
+    else if(msg.type === 'connect') {
+        seq = 0;
+    }
+    else if(msg.type === 'reset') {
+        fileId = null;
+        seq = 0;
+        end = 0;
+    }
+    else if(msg.type === 'highlight') {
+        highlight = compile(msg.pattern, "g");
+        var marks = new Uint32Array(mark(oldest(), total, []));
+        postMessage({'type' : 'marks', 'marks' : marks}, [marks.buffer]);
+    }
+    else if(msg.type === 'find') {
+        var regex = compile(msg.pattern, "");
+        var index = -1;
+        if(regex !== null) {
+            for(var n = Math.max(msg.from, oldest()); n < total; n++) {
+                if(regex.test(lines[n % SCROLLBACK])) {
+                    index = n;
+                    break;
+                }
+            }
+        }
+        postMessage({'type' : 'found', 'index' : index});
+    }
+};
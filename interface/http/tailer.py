@@ -1,7 +1,14 @@
 # $Id$
 
+import os
 import re
 import time
+import mmap
+
+# First backward read of read_tail() is sized for lines of about this length
+AVG_LINE_SIZE = 128
+# Upper bound for a single backward read of read_tail()
+MAX_BLOCK_SIZE = 4 * 1024 * 1024
 
 class Tailer(object):
     """\
@@ -10,10 +17,13 @@ class Tailer(object):
     """
     line_terminators = ('\r\n', '\n', '\r')
 
-    def __init__(self, file, read_size=1024, end=False):
+    def __init__(self, file, read_size=1024, end=False, use_mmap=False):
         self.read_size = read_size
         self.file = file
         self.start_pos = self.file.tell()
+        self.mapping = None
+        if use_mmap:
+            self.mapping = MappedFile(file)
         if end:
             self.seek_end()
     
@@ -49,13 +59,14 @@ class Tailer(object):
             start += 1
 
         while bytes_read > 0:          
-            # Scan forwards, counting the newlines in this bufferfull
-            i = start
-            while i < bytes_read:
-                if read_str[i] in self.line_terminators:
-                    self.seek(pos + i + 1)
-                    return self.file.tell()
-                i += 1
+            # Scan forwards for the first line terminator in this bufferfull
+            found = [i for i in (read_str.find('\n', start),
+                                 read_str.find('\r', start)) if i >= 0]
+            if found:
+                i = min(found)
+                self.seek(pos + i + 1)
+                return self.file.tell()
+            start = 0
 
             pos += self.read_size
             self.seek(pos)
@@ -91,13 +102,12 @@ class Tailer(object):
                 bytes_read -= 1
 
         while bytes_read > 0:          
-            # Scan backward, counting the newlines in this bufferfull
-            i = bytes_read - 1
-            while i >= 0:
-                if read_str[i] in self.line_terminators:
-                    self.seek(pos + i + 1)
-                    return self.file.tell()
-                i -= 1
+            # Scan backward for the last line terminator in this bufferfull
+            i = max(read_str.rfind('\n', 0, bytes_read),
+                    read_str.rfind('\r', 0, bytes_read))
+            if i >= 0:
+                self.seek(pos + i + 1)
+                return self.file.tell()
 
             if pos == 0 or pos - self.read_size < 0:
                 # Not enought lines in the buffer, send the whole file
@@ -114,15 +124,15 @@ class Tailer(object):
     def tail(self, lines=10):
         """\
         Return the last lines of the file.
-        """
-        self.seek_end()
-        end_pos = self.file.tell()
 
-        for i in xrange(lines):
-            if not self.seek_line():
-                break
+        With use_mmap the lines are buffers sliced out of the mapping.
+        """
+        if self.mapping is not None:
+            start, end = self.mapping.tail_range(lines)
+            self.seek(end)
+            return self.mapping.lines(start, end)
 
-        data = self.file.read(end_pos - self.file.tell() - 1)
+        data = read_tail(self.file, lines, self.read_size)
         if data:
             return self.splitlines(data)
         else:
@@ -131,7 +141,13 @@ class Tailer(object):
     def head(self, lines=10):
         """\
         Return the top lines of the file.
+
+        With use_mmap the lines are buffers sliced out of the mapping.
         """
+        if self.mapping is not None:
+            start, end = self.mapping.head_range(lines)
+            return self.mapping.lines(start, end)
+
         self.seek(0)
 
         for i in xrange(lines):
@@ -183,8 +199,173 @@ class Tailer(object):
         return self.follow()
 
     def close(self):
+        if self.mapping is not None:
+            self.mapping.close()
         self.file.close()
 
+class MappedFile(object):
+    """\
+    Read-only mmap of a file, used to find line boundaries and slice lines
+    out without reading the data through the file object.
+
+    The mapping is redone by remap() when the size of the file changed.  A
+    replaced mapping is only dropped, never closed, so buffers handed out
+    earlier stay valid until their last reference goes away.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.map = None
+        self.size = 0
+        self.remap()
+
+    def remap(self):
+        """\
+        Map the file again if it grew or shrank, return the mapped size.
+        """
+        size = os.fstat(self.file.fileno()).st_size
+        if size != self.size or (size and self.map is None):
+            if size:
+                self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+            else:
+                self.map = None
+            self.size = size
+        return self.size
+
+    def tail_range(self, lines=10):
+        """\
+        Return the (start, end) offsets of the last lines, end excludes the
+        final line terminator.
+        """
+        end = self.remap()
+        if lines <= 0 or not end:
+            return end, end
+
+        m = self.map
+        if m[end - 1] == '\n':
+            end -= 1
+            if end and m[end - 1] == '\r':
+                end -= 1
+
+        idx = end
+        for i in xrange(lines):
+            idx = m.rfind('\n', 0, idx)
+            if idx < 0:
+                break
+        return idx + 1, end
+
+    def head_range(self, lines=10):
+        """\
+        Return the (start, end) offsets of the first lines, end excludes the
+        last line terminator.
+        """
+        size = self.remap()
+        if lines <= 0 or not size:
+            return 0, 0
+
+        m = self.map
+        idx = -1
+        for i in xrange(lines):
+            idx = m.find('\n', idx + 1)
+            if idx < 0:
+                idx = size
+                if m[idx - 1] == '\n':
+                    idx -= 1
+                break
+        if idx and m[idx - 1] == '\r':
+            idx -= 1
+        return 0, idx
+
+    def view(self, start, end):
+        """\
+        Return the bytes in [start, end) as a buffer over the mapping.
+        """
+        if self.map is None or start >= end:
+            return buffer('')
+        return buffer(self.map, start, end - start)
+
+    def lines(self, start, end):
+        """\
+        Return the lines in [start, end) as buffers over the mapping.
+        """
+        if self.map is None or start >= end:
+            return []
+
+        m = self.map
+        result = []
+        while start <= end:
+            idx = m.find('\n', start, end)
+            if idx < 0:
+                idx = end
+            stop = idx
+            if stop > start and m[stop - 1] == '\r':
+                stop -= 1
+            result.append(buffer(m, start, stop - start))
+            start = idx + 1
+        return result
+
+    def close(self):
+        self.map = None
+        self.size = 0
+
+def read_tail(file, lines=10, read_size=1024):
+    """\
+    Return the data of the last lines of the file as a single string, without
+    the final line terminator, and leave the file positioned at the end of
+    the data, before that terminator.
+
+    The file is read backwards from the end in blocks which start at
+    lines * AVG_LINE_SIZE bytes and double on every step, newlines are found
+    with str.count / str.rfind, so every byte is read once at most.  Only
+    '\\n' is scanned for, which covers both '\\n' and '\\r\\n' terminated files.
+
+    >>> import StringIO
+    >>> f = StringIO.StringIO()
+    >>> for i in range(11):
+    ...     f.write('Line %d\\n' % (i + 1))
+    >>> read_tail(f, 2, read_size=4)
+    'Line 10\\nLine 11'
+    """
+    file.seek(0, 2)
+    end_pos = file.tell()
+    if lines <= 0 or end_pos == 0:
+        return ''
+
+    block_size = min(max(read_size, lines * AVG_LINE_SIZE), MAX_BLOCK_SIZE)
+    chunks = []
+    need = lines
+    pos = end = end_pos
+    while pos > 0:
+        size = min(block_size, pos)
+        pos -= size
+        file.seek(pos)
+        chunk = file.read(size)
+
+        idx = len(chunk)
+        if not chunks and chunk.endswith('\n'):
+            # The final line terminator does not start a new line
+            idx -= 1
+            if chunk[idx - 1:idx] == '\r':
+                idx -= 1
+            end = pos + idx
+            chunk = chunk[:idx]
+
+        found = chunk.count('\n', 0, idx)
+        if found >= need:
+            while need:
+                idx = chunk.rfind('\n', 0, idx)
+                need -= 1
+            chunks.append(chunk[idx + 1:])
+            break
+
+        need -= found
+        chunks.append(chunk)
+        block_size = min(block_size * 2, MAX_BLOCK_SIZE)
+
+    chunks.reverse()
+    file.seek(end)
+    return ''.join(chunks)
+
 def tail(file, lines=10):
     """\
     Return the last lines of the file.
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+"""\
+Seek to the first line of a log written at or after a given time.
+
+The file is binary searched by byte offset: every probe is realigned to a
+line start with Tailer.seek_line_forward() and the timestamp of the line is
+parsed with the strptime format configured for the file.  Probed lines are
+kept as (time, offset) checkpoints which narrow later searches, and answers
+are cached per requested time.
+"""
+
+import os
+import re
+import time
+import bisect
+
+from tailer import Tailer
+from compressed import open_log
+
+DEFAULT_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Below this many bytes the binary search turns into a forward scan
+LINEAR_SCAN = 64 * 1024
+
+# strptime directive -> regular expression matching it
+_DIRECTIVES = {
+    'Y': r'\d{4}',
+    'y': r'\d{2}',
+    'm': r'\d{1,2}',
+    'd': r'\d{1,2}',
+    'e': r' ?\d{1,2}',
+    'H': r'\d{1,2}',
+    'I': r'\d{1,2}',
+    'M': r'\d{2}',
+    'S': r'\d{2}',
+    'f': r'\d{1,6}',
+    'j': r'\d{3}',
+    'p': r'[AaPp][Mm]',
+    'b': r'[A-Za-z]{3}',
+    'a': r'[A-Za-z]{3}',
+    '%': '%',
+}
+
+def format_regex(fmt):
+    """\
+    Return a regular expression matching the text strptime(fmt) parses.
+
+    >>> format_regex('%Y-%m-%d %H:%M').pattern
+    '\\\\d{4}\\\\-\\\\d{1,2}\\\\-\\\\d{1,2}\\\\s+\\\\d{1,2}\\\\:\\\\d{2}'
+    """
+    parts = []
+    i = 0
+    while i < len(fmt):
+        c = fmt[i]
+        if c == '%' and i + 1 < len(fmt):
+            directive = fmt[i + 1]
+            if directive not in _DIRECTIVES:
+                raise ValueError('unsupported directive %%%s in %r' % (directive, fmt))
+            parts.append(_DIRECTIVES[directive])
+            i += 2
+        elif c.isspace():
+            parts.append(r'\s+')
+            i += 1
+        else:
+            parts.append(re.escape(c))
+            i += 1
+    return re.compile(''.join(parts))
+
+def parse_since(value, now=None):
+    """\
+    Parse the since= argument: seconds since the epoch, 'HH:MM[:SS]' for
+    today, or 'YYYY-mm-dd HH:MM[:SS]' (a 'T' separator works too), in local
+    time.  Raise ValueError for anything else.
+    """
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    value = value.replace('T', ' ')
+    if now is None:
+        now = time.time()
+    today = time.strftime('%Y-%m-%d ', time.localtime(now))
+    for fmt, prefix in (('%Y-%m-%d %H:%M:%S', ''), ('%Y-%m-%d %H:%M', ''),
+                        ('%Y-%m-%d %H:%M:%S', today), ('%Y-%m-%d %H:%M', today)):
+        try:
+            return time.mktime(time.strptime(prefix + value, fmt))
+        except ValueError:
+            continue
+    raise ValueError('cannot parse time %r' % value)
+
+
+class TimestampParser(object):
+    """\
+    Extract the timestamp of a log line as seconds since the epoch.
+    """
+    def __init__(self, fmt=DEFAULT_TIME_FORMAT):
+        self.fmt = fmt
+        self.regex = format_regex(fmt)
+        # syslog style formats have no year, assume the current one
+        self.has_year = '%Y' in fmt or '%y' in fmt
+        # consecutive lines mostly share their timestamp
+        self.last_text = None
+        self.last_stamp = None
+
+    def parse(self, line):
+        m = self.regex.search(line)
+        if m is None:
+            return None
+        text = m.group(0)
+        if text == self.last_text:
+            return self.last_stamp
+        try:
+            parsed = time.strptime(text, self.fmt)
+        except ValueError:
+            return None
+        if not self.has_year:
+            parsed = (time.localtime().tm_year,) + tuple(parsed)[1:]
+        self.last_text = text
+        self.last_stamp = time.mktime(tuple(parsed))
+        return self.last_stamp
+
+
+# path -> TimeIndex
+time_indexes = {}
+
+def get_time_index(path, fmt=DEFAULT_TIME_FORMAT):
+    index = time_indexes.get(path)
+    if index is None or index.parser.fmt != fmt:
+        index = time_indexes[path] = TimeIndex(path, fmt)
+    return index
+
+
+class TimeIndex(object):
+    def __init__(self, path, fmt=DEFAULT_TIME_FORMAT):
+        self.path = path
+        self.parser = TimestampParser(fmt)
+        self.reset()
+
+    def reset(self, ino=None):
+        # sorted (time, offset of the line start) of probed lines
+        self.checkpoints = []
+        # requested time -> offset of the first line at or after it
+        self.cache = {}
+        self.ino = ino
+        self.size = 0
+
+    def add_checkpoint(self, stamp, offset):
+        item = (stamp, offset)
+        i = bisect.bisect_left(self.checkpoints, item)
+        if i == len(self.checkpoints) or self.checkpoints[i] != item:
+            self.checkpoints.insert(i, item)
+
+    def seek(self, since):
+        """\
+        Return the offset of the first line stamped at or after since, the
+        size of the file if there is none.
+        """
+        f = open_log(self.path)
+        try:
+            ino = os.fstat(f.fileno()).st_ino
+            # the uncompressed size for an archive
+            f.seek(0, 2)
+            size = f.tell()
+            if ino != self.ino or size < self.size:
+                self.reset(ino)
+            self.size = size
+
+            offset = self.cache.get(since)
+            if offset is None:
+                offset = self.search(f, since)
+                if offset < self.size:
+                    # the log only grows, a line found stays the answer
+                    self.cache[since] = offset
+            return offset
+        finally:
+            f.close()
+
+    def search(self, f, since):
+        lo, hi = 0, self.size
+        # narrow the range with what earlier searches probed
+        i = bisect.bisect_left(self.checkpoints, (since, -1))
+        if i > 0:
+            lo = self.checkpoints[i - 1][1]
+        if i < len(self.checkpoints):
+            hi = self.checkpoints[i][1]
+
+        tailer = Tailer(f)
+        while hi - lo > LINEAR_SCAN:
+            mid = (lo + hi) // 2
+            tailer.seek(mid)
+            if tailer.seek_line_forward() is None:
+                hi = mid
+                continue
+
+            stamp, start, end = self.read_stamp(f, hi)
+            if stamp is None:
+                # only continuation lines between mid and hi
+                hi = mid
+                continue
+
+            self.add_checkpoint(stamp, start)
+            if stamp < since:
+                lo = end
+            else:
+                hi = start
+
+        return self.scan(f, lo, since)
+
+    def read_stamp(self, f, limit):
+        """\
+        Return (time, start, end) of the first stamped line starting between
+        the current position and limit, (None, None, None) if there is none.
+        """
+        pos = f.tell()
+        while pos < limit:
+            line = f.readline()
+            if not line:
+                break
+            stamp = self.parser.parse(line)
+            if stamp is not None:
+                return stamp, pos, pos + len(line)
+            pos += len(line)
+        return None, None, None
+
+    def scan(self, f, pos, since):
+        f.seek(pos)
+        while True:
+            line = f.readline()
+            if not line:
+                return pos
+            stamp = self.parser.parse(line)
+            if stamp is not None and stamp >= since:
+                self.add_checkpoint(stamp, pos)
+                return pos
+            pos += len(line)
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == '__main__':
+    _test()
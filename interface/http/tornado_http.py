@@ -2,17 +2,34 @@
 import os, sys
 import time
 import re
+import fnmatch
+import glob
+from collections import deque
 
 import tornado
 from tornado import ioloop, httpserver, websocket
 import tornado.ioloop
 import tornado.web
+from tornado.escape import json_decode, json_encode, utf8
 
 import logging
 
 
 import pyinotify
-from tornado_pyinotify import TornadoNotifier
+from tornado_pyinotify import WatchRegistry
+from tailer import read_tail, MappedFile
+from wsframe import build_frame, frame_stream, Frames, Batch, file_id, RSV1, deflate, \
+        count_compressed, compression_stats, connection_compressor, share_frames, \
+        window_bits
+from line_index import get_index, peek_index, INDEX_STEP
+from time_index import get_time_index, parse_since, TimestampParser, DEFAULT_TIME_FORMAT
+from line_filter import get_filter, FilterSet
+from log_search import ParallelSearch, SEARCH_CHUNK
+from compressed import open_log, is_archive, prepare
+from merge import TimelineMerger, MERGE_WINDOW, MERGE_MAX_PENDING
+from catalog import FileCatalog
+import output_queue
+from output_queue import OutputQueue, buffered_bytes
 
 def log(msg):
     print msg
@@ -21,18 +38,89 @@ def err_log(msg):
     print >> sys.stderr, msg
 
 BASIC_PATH = '/tmp'
+# inotify events a tailed file is watched for
+TAIL_EVENTS = (pyinotify.IN_MODIFY | pyinotify.IN_MOVE_SELF |
+               pyinotify.IN_DELETE_SELF | pyinotify.IN_ATTRIB)
+# inotify events the directory of a tailed file is watched for, to notice a
+# new file taking its name; the moves also let pyinotify track the old one
+DIR_EVENTS = (pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO |
+              pyinotify.IN_MOVED_FROM)
+# Serve the initial backlog out of a read-only mmap of the log
+USE_MMAP = False
+# WebSocket lines are coalesced into one frame for up to COALESCE_TIME
+# seconds or COALESCE_BYTES bytes, whichever comes first; 0 disables
+COALESCE_TIME = 0.02
+COALESCE_BYTES = 64 * 1024
+# Recent lines kept in memory per followed file for late joiners, and
+# overrides by fnmatch pattern of the path relative to BASIC_PATH
+BUFFER_LINES = 1000
+BUFFER_LINES_PER_FILE = {}
+# Sidecar line index files go to INDEX_DIR, next to the log if None
+INDEX_DIR = None
+# Most lines a single /lines request returns
+LINES_LIMIT = 10000
+# strptime format of the line timestamps for since=, and overrides by
+# fnmatch pattern of the path relative to BASIC_PATH
+TIME_FORMAT = DEFAULT_TIME_FORMAT
+TIME_FORMAT_PER_FILE = {}
+# Bytes of history sent per IOLoop iteration to a viewer starting at since=
+CATCHUP_CHUNK = 1024 * 1024
+# Most matching lines a single /search request returns, and worker
+# processes of the search pool (one per core if None)
+SEARCH_LIMIT = 1000
+SEARCH_PROCESSES = None
+# Most files a merged stream follows
+MERGE_MAX_FILES = 64
+# A viewer with more than OUTPUT_LIMIT bytes waiting in its write buffer
+# gets its lines through a queue of at most OUTPUT_LIMIT bytes; when that
+# is full too, SLOW_CLIENT_POLICY 'drop-oldest' drops its oldest lines,
+# 'sample' every other line and 'disconnect' closes the connection
+OUTPUT_LIMIT = 1024 * 1024
+SLOW_CLIENT_POLICY = 'drop-oldest'
+# Compress WebSocket messages (permessage-deflate) for the browsers which
+# offer it.  With COMPRESS_ONCE the lines broadcast to the viewers of a
+# file are compressed once for all of them with the same window size, at
+# the price of compressing every message of those viewers without the
+# context of the previous ones, for less CPU but a worse ratio
+WS_COMPRESSION = True
+COMPRESS_ONCE = False
 
 class Application(tornado.web.Application):
     def __init__(self):
         handlers = [
             (r"/tail/?", TailHandler),
+            (r"/lines/?", LinesHandler),
+            (r"/search/?", SearchHandler),
+            (r"/files/?", FilesHandler),
+            (r"/websocket/files/?", WSFilesHandler),
             (r"/websocket/tail/(?P<filename>.*)", WSTailHandler),
+            (r"/websocket/merge/?", WSMergeHandler),
+            (r"/metrics/?", MetricsHandler),
             (r"/", MainHandler),
         ] 
         settings = dict(
             static_path = os.path.join(os.path.dirname(__file__), "static"),
             template_path = os.path.join(os.path.dirname(__file__), "tmpl"), 
             basic_path = BASIC_PATH,
+            use_mmap = USE_MMAP,
+            coalesce_time = COALESCE_TIME,
+            coalesce_bytes = COALESCE_BYTES,
+            buffer_lines = BUFFER_LINES,
+            buffer_lines_per_file = BUFFER_LINES_PER_FILE,
+            index_dir = INDEX_DIR,
+            index_step = INDEX_STEP,
+            time_format = TIME_FORMAT,
+            time_format_per_file = TIME_FORMAT_PER_FILE,
+            search_limit = SEARCH_LIMIT,
+            search_chunk = SEARCH_CHUNK,
+            search_processes = SEARCH_PROCESSES,
+            merge_window = MERGE_WINDOW,
+            merge_max_pending = MERGE_MAX_PENDING,
+            merge_max_files = MERGE_MAX_FILES,
+            output_limit = OUTPUT_LIMIT,
+            slow_client_policy = SLOW_CLIENT_POLICY,
+            ws_compression = WS_COMPRESSION,
+            compress_once = COMPRESS_ONCE,
         )
         tornado.web.Application.__init__(self, handlers, **settings)
 
@@ -48,23 +136,35 @@ class TailMixin(object):
     
     line_terminators = ('\r\n', '\n', '\r')
     read_size = 1024
+    use_mmap = False
+    mapping = None
+    # offset of the first line returned by the last tail()
+    tail_offset = 0
 
 
     def seek(self, pos, whence=0):
         self.fd.seek(pos, whence)
 
+    def get_mapping(self):
+        if self.mapping is None:
+            self.mapping = MappedFile(self.fd)
+        return self.mapping
+
     def tail(self, lines=10):
         """\
         Return the last lines of the file.
         """
-        self.seek_end()
-        end_pos = self.fd.tell()
-
-        for i in xrange(lines):
-            if not self.seek_line():
-                break
-
-        data = self.fd.read(end_pos - self.fd.tell() - 1)
+        if self.use_mmap:
+            mapping = self.get_mapping()
+            start, end = mapping.tail_range(lines)
+            self.tail_offset = start
+            self.seek(end)
+            return mapping.lines(start, end)
+
+        data = read_tail(self.fd, lines, self.read_size)
+        # like the mmap branch, leave the fd at the end of data, before the
+        # final line terminator drain() skips as trailing
+        self.tail_offset = self.fd.tell() - len(data)
         if data:
             return self.splitlines(data)
         else:
@@ -97,13 +197,12 @@ class TailMixin(object):
                 bytes_read -= 1
 
         while bytes_read > 0:          
-            # Scan backward, counting the newlines in this bufferfull
-            i = bytes_read - 1
-            while i >= 0:
-                if read_str[i] in self.line_terminators:
-                    self.seek(pos + i + 1)
-                    return self.fd.tell()
-                i -= 1
+            # Scan backward for the last line terminator in this bufferfull
+            i = max(read_str.rfind('\n', 0, bytes_read),
+                    read_str.rfind('\r', 0, bytes_read))
+            if i >= 0:
+                self.seek(pos + i + 1)
+                return self.fd.tell()
 
             if pos == 0 or pos - self.read_size < 0:
                 # Not enought lines in the buffer, send the whole file
@@ -132,177 +231,835 @@ class TailMixin(object):
         self.seek(0, 2)
 
 class CallbackTailMixin(TailMixin):
+    # upper bound for a single os.read() of appended data
+    drain_size = 4 * 1024 * 1024
+    # file offset of the next byte to read, taken from fd on the first drain
+    offset = None
+    # unterminated tail of the last read, completed by the next one
+    partial = ''
+    # [start, end) file range of the lines of the last on_lines() call
+    lines_start = lines_end = 0
+    # truncations in place of the open file, part of its file_id
+    truncations = 0
+    # watch descriptor in the shared WatchRegistry
+    wd = None
+    # watch descriptor of the parent directory
+    dir_wd = None
+    _has_init_inotify = False
+
     def on_line(self, line):
         pass
 
-    def follow(self):
-        while True:
-            if self.fd.closed:
-                break
-            fileno = self.fd.fileno()
-            stats = os.fstat(fileno)
-
-            where = self.fd.tell()
-            line = self.fd.readline()
-            if line:    
-                if self.trailing and line in self.line_terminators:
-                    # This is just the line terminator added to the end of the file
-                    # before a new line, ignore.
-                    trailing = False
-                    self.timeout_handle = ioloop.IOLoop.instance().add_timeout(time.time() + 0.1, self.follow)
-                    return
+    def on_lines(self, lines):
+        for line in lines:
+            self.on_line(line)
 
-                if line[-1] in self.line_terminators:
-                    line = line[:-1]
-                    if line[-1:] == '\r\n' and '\r\n' in self.line_terminators:
-                        # found crlf
-                        line = line[:-1]
+    def on_data(self, data, offset):
+        pass
 
-                self.trailing = False
-                self.on_line(line)
-            else:
-                self.trailing = True
-                if where > stats.st_size:
-                    where = stats.st_size
-                    self.on_line('%s: file truncated\n' % self.filename)
-                self.seek(where)
-                self.timeout_handle = ioloop.IOLoop.instance().add_timeout(time.time() + 0.1, self.follow)
-                break
+    def flush_lines(self):
+        pass
+
+    def follow(self):
+        self.drain()
+        self.check_rotation()
+        if not self.fd.closed:
+            self.timeout_handle = ioloop.IOLoop.instance().add_timeout(time.time() + 0.1, self.follow)
 
     def handler_inotify(self, event):
-        while True:
-            if self.fd.closed:
-                break
-            fileno = self.fd.fileno()
-            stats = os.fstat(fileno)
-
-            where = self.fd.tell()
-            line = self.fd.readline()
-            if line:    
-                if self.trailing and line in self.line_terminators:
-                    # This is just the line terminator added to the end of the file
-                    # before a new line, ignore.
-                    trailing = False
-                    continue
-
-                if line[-1] in self.line_terminators:
-                    line = line[:-1]
-                    if line[-1:] == '\r\n' and '\r\n' in self.line_terminators:
-                        # found crlf
-                        line = line[:-1]
+        self.drain()
 
-                self.trailing = False
-                self.on_line(line)
-            else:
-                self.trailing = True
-                if where > stats.st_size:
-                    where = stats.st_size
-                    self.on_line('%s: file truncated\n' % self.filename)
-                self.seek(where)
+    def handler_rotate(self, event):
+        # directory events are about any of its entries
+        if event.name and event.name != os.path.basename(self.filename):
+            return
+        self.check_rotation()
+
+    def check_rotation(self):
+        """\
+        Switch to the file now named filename if it is not the open one
+        (logrotate renamed or deleted it), after reading what is left of the
+        open one.  Until a new file shows up the open one keeps being read.
+        """
+        if self.fd.closed:
+            return
+        try:
+            ino = os.stat(self.filename).st_ino
+        except OSError:
+            ino = None
+        if ino == os.fstat(self.fd.fileno()).st_ino:
+            return
+
+        self.drain()
+        if ino is not None:
+            self.reopen()
+
+    def reopen(self):
+        """\
+        Follow the new file at filename from offset 0.
+        """
+        try:
+            fd = open(self.filename, 'r')
+        except IOError, e:
+            err_log(str(e))
+            return
+
+        if self.partial:
+            # the old file ended without a line terminator
+            self.lines_start = self.offset - len(self.partial)
+            self.lines_end = self.offset
+            self.on_lines([self.partial.rstrip('\r')])
+        if self.wd is not None:
+            self.watch_registry.remove(self.wd, self.event_handler)
+            self.wd = None
+        self.mapping = None
+        self.fd.close()
+
+        self.fd = fd
+        self.truncations = 0
+        self.file_id = file_id(fd)
+        self.offset = 0
+        self.partial = ''
+        self.trailing = False
+        if self._has_init_inotify:
+            self.follow_inotify()
+        self.drain()
+
+    def drain(self):
+        """\
+        Read everything appended since the last drain with one os.read per
+        drain_size bytes and pass the complete lines to on_lines() as a
+        single batch.  An unterminated last line is kept for the next drain.
+        """
+        if self.fd.closed:
+            return
+        fileno = self.fd.fileno()
+        size = os.fstat(fileno).st_size
+
+        if self.offset is None:
+            self.offset = self.fd.tell()
+        if self.offset > size:
+            # truncated in place (copytruncate), the new data starts at 0
+            # and offsets of the old data must not resume into it
+            self.truncations += 1
+            self.file_id = file_id(self.fd, self.truncations)
+            self.offset = 0
+            self.partial = ''
+            self.trailing = False
+            # lines of the old data go out before the notice
+            self.flush_lines()
+            self.on_line(utf8('%s: file truncated' % self.filename))
+
+        while self.offset < size:
+            os.lseek(fileno, self.offset, 0)
+            data = os.read(fileno, min(size - self.offset, self.drain_size))
+            if not data:
                 break
+            self.on_data(data, self.offset)
+            # file offset of data[0], and of the first line; a batch starts
+            # where the one before ended, terminator left by tail() included
+            pos = self.offset
+            start = pos - len(self.partial)
+            self.offset += len(data)
+
+            if self.trailing:
+                # This is just the line terminator added to the end of the file
+                # before a new line, ignore.
+                self.trailing = False
+                if data[:2] == '\r\n':
+                    data = data[2:]
+                    pos += 2
+                elif data[:1] == '\n':
+                    data = data[1:]
+                    pos += 1
+
+            cut = data.rfind('\n')
+            if cut < 0:
+                self.partial += data
+                continue
+
+            self.lines_start = start
+            self.lines_end = pos + cut + 1
+            complete = self.partial + data[:cut]
+            self.partial = data[cut + 1:]
+            lines = complete.split('\n')
+            if '\r' in complete:
+                lines = [line[:-1] if line[-1:] == '\r' else line for line in lines]
+            self.on_lines(lines)
 
 
 
     def init_inotify(self):
-        self.watch_manager = pyinotify.WatchManager()
-        handler = EventHandler(handler = self.handler_inotify)
-        self.notifier = TornadoNotifier(self.watch_manager, handler, io_loop = ioloop.IOLoop.instance())
+        if self._has_init_inotify:
+            return
+        self.watch_registry = WatchRegistry.instance()
+        self.event_handler = EventHandler(handler = self.handler_inotify,
+                                          rotate_handler = self.handler_rotate)
         self._has_init_inotify = True
 
     def follow_inotify(self):
         assert self._has_init_inotify
-        self.watch_manager.add_watch(self.filename, pyinotify.ALL_EVENTS)
+        if self.wd is None:
+            self.wd = self.watch_registry.add(self.filename, self.event_handler, TAIL_EVENTS)
+        if self.dir_wd is None:
+            self.dir_wd = self.watch_registry.add(os.path.dirname(self.filename),
+                                                  self.event_handler, DIR_EVENTS)
+
+    def unfollow_inotify(self):
+        if self.wd is not None:
+            self.watch_registry.remove(self.wd, self.event_handler)
+            self.wd = None
+        if self.dir_wd is not None:
+            self.watch_registry.remove(self.dir_wd, self.event_handler)
+            self.dir_wd = None
 
 class EventHandler(pyinotify.ProcessEvent):
-    def my_init(self, handler):
+    def my_init(self, handler, rotate_handler = None):
         self.handler = handler
+        self.rotate_handler = rotate_handler
 
     def process_IN_MODIFY(self, event):
         self.handler(event)
+
+    def process_rotation(self, event):
+        if self.rotate_handler is not None:
+            self.rotate_handler(event)
+
+    # the file was renamed, deleted (IN_ATTRIB for the link count while it
+    # is still open) or a file appeared in its directory
+    process_IN_MOVE_SELF = process_rotation
+    process_IN_DELETE_SELF = process_rotation
+    process_IN_ATTRIB = process_rotation
+    process_IN_CREATE = process_rotation
+    process_IN_MOVED_TO = process_rotation
         
 
 class TailFileClient(CallbackTailMixin):
-    def __init__(self, filename, init_lines = 10):
-        fd = open(filename, 'r')
+    def __init__(self, filename, init_lines = 10, use_mmap = False,
+                 coalesce_time = 0, coalesce_bytes = 0, buffer_lines = 0):
+        fd = open_log(filename)
         self.filename = filename
         self.fd = fd
         self.waiters = set()
         #self.set_line_callback(callback)
         self.init_lines = init_lines
+        # compressed rotated logs are read through an ArchiveFile and do
+        # not grow, they are neither mapped nor followed
+        self.archive = is_archive(filename)
+        self.use_mmap = use_mmap and not self.archive
+        self.file_id = file_id(fd)
+        # number of the last broadcast batch
+        self.seq = 0
+        # ring buffer of the most recent broadcast batches, as
+        # (Batch, lines), holding at least recent_max lines
+        self.recent = deque()
+        self.recent_lines = 0
+        self.recent_max = max(buffer_lines, init_lines)
+        self.started = False
+        # clients being sent history by catch_up() before they join waiters
+        self.catching_up = set()
+        self.coalesce_time = coalesce_time
+        self.coalesce_bytes = coalesce_bytes
+        self.pending = []
+        self.pending_bytes = 0
+        # file and file range of the pending lines
+        self.pending_file_id = self.file_id
+        self.pending_start = self.pending_end = 0
+        self.flush_handle = None
         self.trailing = True
         self.timeout_handle = None
+        # FilterSet of the distinct line filters of the waiters
+        self.filter_set = None
 
     def on_line(self, line, client = None):
         if client is not None:
             client.on_line(line)
             return
 
+        for cl in list(self.waiters):
+            self.deliver(cl, cl.on_line, line)
+
+    def on_data(self, data, offset):
+        # keep a loaded line index up to date with what the follower reads
+        index = peek_index(self.filename)
+        if index is not None:
+            index.feed(data, offset)
+
+    def on_lines(self, lines):
+        """\
+        Queue lines for broadcast.  They are sent once coalesce_bytes are
+        pending or coalesce_time has passed since the first queued line, or
+        before lines which do not follow them in the file.
+        """
+        if self.pending and (self.lines_start != self.pending_end or
+                             self.file_id != self.pending_file_id):
+            # truncated or rotated
+            self.flush_lines()
+        if not self.pending:
+            self.pending_file_id = self.file_id
+            self.pending_start = self.lines_start
+        self.pending_end = self.lines_end
+        self.pending.extend(lines)
+        self.pending_bytes += sum(len(line) for line in lines) + len(lines)
+
+        if self.pending_bytes >= self.coalesce_bytes or not self.coalesce_time:
+            self.flush_lines()
+        elif self.flush_handle is None:
+            self.flush_handle = ioloop.IOLoop.instance().add_timeout(
+                    time.time() + self.coalesce_time, self.flush_lines)
+
+    def flush_lines(self):
+        if self.flush_handle is not None:
+            ioloop.IOLoop.instance().remove_timeout(self.flush_handle)
+            self.flush_handle = None
+        if self.pending:
+            lines, self.pending, self.pending_bytes = self.pending, [], 0
+            self.seq += 1
+            self.broadcast(lines, Batch(self.pending_file_id, self.seq,
+                                        self.pending_start, self.pending_end))
+
+    def remember(self, batch, lines):
+        """\
+        Add a batch to the recent lines buffer.
+        """
+        recent = self.recent
+        recent.append((batch, lines))
+        self.recent_lines += len(lines)
+        while recent and self.recent_lines - len(recent[0][1]) >= self.recent_max:
+            self.recent_lines -= len(recent.popleft()[1])
+
+    def broadcast(self, lines, batch):
+        """\
+        Send lines to every waiter.  Waiters are grouped by their shared
+        line_filter, the lines of all groups are selected in a single pass
+        by a FilterSet and each group's payload and WebSocket frames are
+        built once for all of its waiters.
+        """
+        self.remember(batch, lines)
+
+        groups = {}
         for cl in self.waiters:
+            groups.setdefault(cl.line_filter, []).append(cl)
+
+        filters = frozenset(f for f in groups if f is not None)
+        selection = {}
+        if filters:
+            if self.filter_set is None or self.filter_set.key != filters:
+                self.filter_set = FilterSet(filters)
+            selection = self.filter_set.select(lines)
+
+        for line_filter, clients in groups.iteritems():
+            selected = lines if line_filter is None else selection[line_filter]
+            if not selected:
+                continue
+            payload = '\n'.join(selected) + '\n'
+            frames = Frames(payload, selected, batch)
+            for cl in clients:
+                self.deliver(cl, cl.on_frame, payload, frames)
+
+    def deliver(self, client, method, *args):
+        """\
+        Call method(*args) of a waiter, a waiter which fails is logged,
+        unsubscribed and disconnected so the others still get their lines.
+        """
+        try:
+            method(*args)
+        except Exception, e:
+            err_log('%s: dropping viewer %r: %s' % (self.filename, client, e))
+            client.unsubscribe()
             try:
-                cl.on_line(line)
-            except:
-                pass
+                client.disconnect()
+            except Exception, e:
+                err_log('%s: closing viewer %r: %s' % (self.filename, client, e))
 
-    def start(self, client = None):
-        init_lines = self.init_lines
-        if init_lines and isinstance(init_lines, (int, long)):
-            lines = self.tail(init_lines)
-            for line in lines:
-                self.on_line(line, client = client)
+    def start(self):
+        """\
+        Fill the recent lines buffer from the end of the file and start
+        following it.  Only the first call does anything.
+        """
+        if self.started:
+            return
+        self.started = True
+
+        lines = self.tail(self.recent_max)
+        if self.use_mmap:
+            # the ring outlives mappings and its lines are joined into
+            # messages, it keeps strings rather than buffers of the mmap
+            lines = [line[:] for line in lines]
+        self.offset = self.fd.tell()
+        self.remember(Batch(self.file_id, 0, self.tail_offset, self.offset), lines)
 
+        if self.archive:
+            return
         #self.follow()
         self.init_inotify()
         self.follow_inotify()
 
+    def backlog(self, lines, line_filter = None):
+        """\
+        Return the last lines (selected by line_filter if given) from the
+        recent lines buffer, and the Batch covering them: from the start of
+        the first line sent, or of the open file if they go back past it,
+        to the end of the buffer.
+
+        >>> import tempfile
+        >>> path = tempfile.mktemp()
+        >>> open(path, 'w').write(''.join('line %d\\n' % i for i in range(5)))
+        >>> client = TailFileClient(path, buffer_lines = 10)
+        >>> client.start()
+        >>> open(path, 'a').write('line 5\\nline 6\\n')
+        >>> client.drain()
+        >>> data = open(path).read()
+        >>> for count in (1, 3, 9):
+        ...     lines, batch = client.backlog(count)
+        ...     lines, data[batch.start:batch.end]
+        (['line 6'], 'line 6\\n')
+        (['line 4', 'line 5', 'line 6'], 'line 4\\nline 5\\nline 6\\n')
+        (['line 0', 'line 1', 'line 2', 'line 3', 'line 4', 'line 5', 'line 6'], 'line 0\\nline 1\\nline 2\\nline 3\\nline 4\\nline 5\\nline 6\\n')
+        >>> client.close()
+        >>> os.remove(path)
+        """
+        if lines <= 0 or not self.recent:
+            return [], None
+        last = self.recent[-1][0]
+        start = last.end
+        backlog = []
+        for batch, batch_lines in reversed(self.recent):
+            first = None
+            for i in xrange(len(batch_lines) - 1, -1, -1):
+                line = batch_lines[i]
+                if line_filter is None or line_filter.match(line):
+                    backlog.append(line)
+                    first = i
+                    if len(backlog) == lines:
+                        break
+            # lines of a file rotated or truncated since are from before
+            # the start of the open one
+            if batch.file_id == last.file_id:
+                if len(backlog) == lines:
+                    start = self.line_start(batch, len(batch_lines), first)
+                else:
+                    start = batch.start
+            if len(backlog) == lines:
+                break
+        backlog.reverse()
+        return backlog, last._replace(start = start)
+
+    def line_start(self, batch, count, index):
+        """\
+        Offset in the open file of line index of the count lines of batch.
+        """
+        if index == 0:
+            return batch.start
+        data = self.read_range(batch.start, batch.end)
+        if len(data) != batch.end - batch.start:
+            return batch.start
+        # batches end after their last line terminator, but for the one of
+        # tail() which ends before it
+        pos = len(data) - 1 if data.endswith('\n') else len(data)
+        for i in xrange(count - index):
+            pos = data.rfind('\n', 0, pos)
+            if pos < 0:
+                return batch.start
+        return batch.start + pos + 1
+
+    def position(self):
+        """\
+        Offset of the first byte not broadcast yet, once pending lines are
+        flushed.
+        """
+        return self.offset - len(self.partial)
+
+    def read_range(self, start, end):
+        if self.archive:
+            self.fd.seek(start)
+            return self.fd.read(end - start)
+        fileno = self.fd.fileno()
+        os.lseek(fileno, start, 0)
+        return os.read(fileno, end - start)
+
+    def attach_from(self, client, offset):
+        """\
+        Send client every line from offset on, then add it to the waiters.
+        """
+        self.catching_up.add(client)
+        self.catch_up(client, offset)
+
+    def catch_up(self, client, offset):
+        """\
+        Send client the next CATCHUP_CHUNK bytes of history from offset.
+        Once the followed position is reached in the same IOLoop iteration,
+        the client joins the waiters without a gap or a duplicated line.
+        """
+        if client not in self.catching_up or self.fd.closed:
+            return
+
+        self.flush_lines()
+        end = self.position()
+        last = end - offset <= CATCHUP_CHUNK
+        data = ''
+        if offset < end:
+            data = self.read_range(offset, min(end, offset + CATCHUP_CHUNK))
+        if not last:
+            cut = data.rfind('\n')
+            if cut >= 0:
+                data = data[:cut + 1]
+
+        if data:
+            lines = data.split('\n')
+            if data.endswith('\n'):
+                lines.pop()
+            if '\r' in data:
+                lines = [line[:-1] if line[-1:] == '\r' else line for line in lines]
+            if client.line_filter is not None:
+                lines = client.line_filter.filter(lines)
+            if lines:
+                client.on_lines(lines, Batch(self.file_id, self.seq if last else 0,
+                                             offset, offset + len(data)))
+
+        if last:
+            self.catching_up.discard(client)
+            self.waiters.add(client)
+        else:
+            ioloop.IOLoop.instance().add_callback(self.catch_up, client, offset + len(data))
+
+    def recent_after(self, offset):
+        """\
+        Return the (Batch, lines) of the recent lines buffer which follow
+        offset of the open file, None unless offset is where one of them
+        starts or where the last one ends.
+        """
+        after = []
+        for batch, lines in reversed(self.recent):
+            if batch.file_id != self.file_id:
+                break
+            if batch.end == offset:
+                return after[::-1]
+            if batch.start < offset:
+                break
+            after.append((batch, lines))
+            if batch.start == offset:
+                return after[::-1]
+        return None
+
+    def resume(self, client, file_id, offset):
+        """\
+        Send client every line after offset of the file file_id, from the
+        recent lines buffer if it still holds them, else read from the
+        disk, then add it to the waiters.  A client of a file rotated away
+        since gets the usual backlog.
+        """
+        self.flush_lines()
+        if file_id != self.file_id or offset > self.position():
+            self.attach(client)
+            return
+
+        after = self.recent_after(offset)
+        if after is None:
+            self.attach_from(client, offset)
+            return
+        self.waiters.add(client)
+        for batch, lines in after:
+            if client.line_filter is not None:
+                lines = client.line_filter.filter(lines)
+            if lines:
+                client.on_lines(lines, batch)
+
+    def attach(self, client):
+        """\
+        Add client to the waiters and send it its backlog from memory.
+        """
+        self.waiters.add(client)
+        init_lines = self.init_lines
+        if init_lines and isinstance(init_lines, (int, long)):
+            lines, batch = self.backlog(init_lines, client.line_filter)
+            if lines:
+                client.on_lines(lines, batch)
+
     def close(self):
         if self.timeout_handle:
             ioloop.IOLoop.instance().remove_timeout(self.timeout_handle)
-
+        if self.flush_handle:
+            ioloop.IOLoop.instance().remove_timeout(self.flush_handle)
+            self.flush_handle = None
+        self.unfollow_inotify()
+        self.recent.clear()
+        self.recent_lines = 0
+        self.filter_set = None
+        index = peek_index(self.filename)
+        if index is not None:
+            index.save()
+
+        self.mapping = None
         if self.fd:
             self.fd.close()
         
 
 
 
-class WSTailHandler(websocket.WebSocketHandler):
+class QueuedOutputMixin(object):
+    """\
+    Output of a viewer which may read slower than its logs are written.
+    Messages are written to the connection until more than output_limit
+    bytes wait in its write buffer.  Then their lines go to a bounded
+    OutputQueue, sent as one message once the write buffer drained, and the
+    slow_client_policy decides what becomes of the lines which do not fit.
+
+    The defaults are for WebSocket handlers, a handler with another
+    transport overrides output_stream(), write_frames() and disconnect().
+    """
+    output_queue = None
+    draining = False
+    disconnected = False
+    # the connection takes frames compressed once for all viewers
+    shared_frames = False
+    # lines are sent with the binary protocol
+    binary = False
+
+    def get_compression_options(self):
+        if self.settings.get('ws_compression'):
+            return {}
+        return None
+
+    def output_stream(self):
+        return frame_stream(self)
+
+    def write_frames(self, frames, callback):
+        """\
+        Write the frame of frames this connection takes and call callback
+        once the write buffer is empty.
+        """
+        stream = frame_stream(self)
+        if stream is None:
+            self.write_message(frames.payload)
+            return
+        compressor = connection_compressor(self)
+        if compressor is None:
+            frame = frames.get(self.binary)
+        else:
+            if self.shared_frames:
+                frame = frames.get(self.binary, deflated = True,
+                                   wbits = window_bits(compressor))
+            else:
+                opcode, data = frames.data(self.binary)
+                frame = build_frame(deflate(data, compressor), opcode, RSV1)
+            count_compressed(frames.payload, frame)
+        stream.write(frame, callback)
+
+    def disconnect(self):
+        self.disconnected = True
+        self.close()
+        self.on_close()
+
+    def send_frames(self, frames):
+        """\
+        Send the message of frames now or once the client caught up.
+        """
+        if self.disconnected:
+            return
+        stream = self.output_stream()
+        if stream is None:
+            self.write_frames(frames, None)
+            return
+        queue = self.output_queue
+        if queue is None:
+            queue = self.output_queue = OutputQueue(
+                    self.settings.get('output_limit', OUTPUT_LIMIT),
+                    self.settings.get('slow_client_policy', SLOW_CLIENT_POLICY))
+
+        if self.draining and not buffered_bytes(stream):
+            # another write replaced the callback of the draining one
+            self.on_drained()
+        if self.draining or queue:
+            lines = frames.lines
+            if lines is None:
+                lines = frames.payload.split('\n')[:-1]
+            if not queue.put(lines, frames.batch):
+                log('disconnecting slow client %r' % self)
+                self.disconnect()
+            return
+
+        if buffered_bytes(stream) + len(frames.payload) > queue.limit:
+            self.draining = True
+            self.write_frames(frames, self.on_drained)
+        else:
+            self.write_frames(frames, None)
+
+    def on_drained(self):
+        self.draining = False
+        queue = self.output_queue
+        batch, skipped = queue.batch, queue.skipped
+        # the binary protocol counts the skipped lines in the batch header
+        lines = queue.take(marker = not self.binary or batch is None)
+        if lines or skipped:
+            self.send_frames(Frames('\n'.join(lines) + '\n', lines, batch, skipped))
+
+
+class TailSubscriberMixin(object):
+    """\
+    Attaches a request handler to the TailFileClient shared by every viewer
+    of a file.  The handler gets its own backlog through on_lines() and the
+    followed lines through on_frame(payload, frames), like all other
+    viewers.
+    Only lines accepted by its line_filter are sent, if it has one.
+    """
     clients = {}
+    line_filter = None
+    unsubscribed = False
 
-    def on_line(self, line):
-        self.write_message(line + '\n')
+    def subscribe(self, since = None, resume = None):
+        """\
+        Follow self.filename, starting with the last init_lines lines, with
+        the first line written at or after since (seconds since the epoch)
+        if given, or right after the (file id, offset) a previous connection
+        stopped at if resume is given.
+        """
+        if not prepare(self.filename):
+            # index a compressed archive ARCHIVE_CHUNK bytes per IOLoop
+            # iteration before reading it
+            ioloop.IOLoop.instance().add_callback(lambda: self.resubscribe(since, resume))
+            return
 
-    def _request_income(self):
-        cls = WSTailHandler
+        cls = TailSubscriberMixin
         obj = cls.clients.get(self.filename, None)
-        flagFirst = False
         if obj is None:
             #first request
-            flagFirst = True
             log("first request for %s" % self.filename)
-            obj = TailFileClient(self.filename)
+            obj = TailFileClient(self.filename,
+                    use_mmap = self.settings.get('use_mmap', False),
+                    coalesce_time = self.settings.get('coalesce_time', 0),
+                    coalesce_bytes = self.settings.get('coalesce_bytes', 0),
+                    buffer_lines = self.buffer_lines())
+            obj.start()
             cls.clients[self.filename] = obj
         else:
             log("incomeing request for %s" % self.filename)
-        obj.waiters.add(self)
 
-        if flagFirst:
-            obj.start()
+        if resume is not None:
+            obj.resume(self, *resume)
+        elif since is None:
+            obj.attach(self)
         else:
-            obj.start(client = self)
+            time_format = self.file_setting('time_format', DEFAULT_TIME_FORMAT)
+            obj.attach_from(self, get_time_index(self.filename, time_format).seek(since))
 
+    def resubscribe(self, since, resume):
+        if not self.unsubscribed:
+            self.subscribe(since, resume)
 
-    def on_close(self):
-        cls = WSTailHandler
-        tfc = cls.clients.get(self.filename)
+    def file_setting(self, name, default):
+        """\
+        Value of setting name for self.filename.  The name + '_per_file'
+        setting maps fnmatch patterns of paths relative to basic_path to
+        values overriding the name setting.
+        """
+        relpath = os.path.relpath(self.filename, self.settings['basic_path'])
+        for pattern, value in self.settings.get(name + '_per_file', {}).items():
+            if fnmatch.fnmatch(relpath, pattern):
+                return value
+        return self.settings.get(name, default)
+
+    def set_filter(self, include = None, exclude = None):
+        """\
+        Select the lines sent to this handler by include and exclude regular
+        expressions, shared with handlers using the same patterns.
+
+        @raise re.error: a pattern does not compile.
+        """
+        self.line_filter = get_filter(include, exclude)
+
+    def buffer_lines(self):
+        """\
+        Depth of the recent lines buffer for self.filename.
+        """
+        return self.file_setting('buffer_lines', 0)
+
+    def unsubscribe(self):
+        self.unsubscribed = True
+        cls = TailSubscriberMixin
+        tfc = cls.clients.get(getattr(self, 'filename', None))
+        if tfc is None:
+            return
 
-        tfc.waiters.remove(self)
-        if not tfc.waiters:
+        tfc.waiters.discard(self)
+        tfc.catching_up.discard(self)
+        if not tfc.waiters and not tfc.catching_up:
             tfc.close()
             del cls.clients[self.filename]
-            
+
+
+class WSTailHandler(QueuedOutputMixin, websocket.WebSocketHandler, TailSubscriberMixin):
+    """\
+    /websocket/tail/<filename> streams the lines of a file as text frames
+    of newline terminated lines, or with protocol=binary as binary batches
+    carrying their byte range and batch number (see wsframe).  A binary
+    viewer reconnecting with file_id and resume_offset, the end of the last
+    batch it got, is sent the lines it missed instead of a backlog.
+    """
+    flush_handle = None
+    # Batch of the pending lines, None for lines which are not from the file
+    pending_batch = None
+
+    def on_line(self, line):
+        self.on_lines([line])
+
+    def on_lines(self, lines, batch = None):
+        """\
+        Queue lines, from batch if given, for the next frame.  The frame is
+        sent once it holds coalesce_bytes or coalesce_time has passed since
+        its first line.
+        """
+        if self.pending and (batch is None) != (self.pending_batch is None):
+            self.flush_lines()
+        if batch is not None:
+            if self.pending_batch is None:
+                self.pending_batch = batch
+            else:
+                self.pending_batch = self.pending_batch._replace(seq = batch.seq, end = batch.end)
+        self.pending.extend(lines)
+        self.pending_bytes += sum(len(line) for line in lines) + len(lines)
+
+        coalesce_time = self.settings.get('coalesce_time', 0)
+        if self.pending_bytes >= self.settings.get('coalesce_bytes', 0) or not coalesce_time:
+            self.flush_lines()
+        elif self.flush_handle is None:
+            self.flush_handle = ioloop.IOLoop.instance().add_timeout(
+                    time.time() + coalesce_time, self.flush_lines)
+
+    def on_frame(self, payload, frames):
+        """\
+        Write a frame prebuilt by TailFileClient.broadcast(), after anything
+        still queued for this client alone.
+        """
+        self.flush_lines()
+        self.send_frames(frames)
+
+    def flush_lines(self):
+        """\
+        Send the queued lines as a single frame.
+        """
+        if self.flush_handle is not None:
+            ioloop.IOLoop.instance().remove_timeout(self.flush_handle)
+            self.flush_handle = None
+        if self.pending:
+            lines, self.pending, self.pending_bytes = self.pending, [], 0
+            batch, self.pending_batch = self.pending_batch, None
+            self.send_frames(Frames('\n'.join(lines) + '\n', lines, batch))
+
+    def on_close(self):
+        if self.flush_handle is not None:
+            ioloop.IOLoop.instance().remove_timeout(self.flush_handle)
+            self.flush_handle = None
+        self.unsubscribe()
 
 
     def open(self, *args, **kwargs):
         log('ws incoming.. args = %s, kwargs = %s' % (args, kwargs))
+        self.pending = []
+        self.pending_bytes = 0
+        if self.settings.get('compress_once'):
+            self.shared_frames = share_frames(self)
+        self.binary = self.get_argument('protocol', 'text') == 'binary'
         try:
             #filename = self.get_argument('filename', None)
             filename = kwargs.get('filename', None)
@@ -313,21 +1070,190 @@ class WSTailHandler(websocket.WebSocketHandler):
                     self.write_message('".." is not allowed in filename')
                     return
 
+                since = self.get_argument('since', None)
+                if since:
+                    try:
+                        since = parse_since(since)
+                    except ValueError, e:
+                        self.write_message(str(e))
+                        return
+
+                # file_id and end offset of the last batch a previous
+                # connection got, to send only what it missed
+                resume = None
+                if self.get_argument('resume_offset', None):
+                    try:
+                        resume = (int(self.get_argument('file_id', '0')),
+                                  int(self.get_argument('resume_offset')))
+                    except ValueError:
+                        self.write_message('bad resume_offset')
+                        return
+
+                try:
+                    self.set_filter(self.get_argument('include', None),
+                                    self.get_argument('exclude', None))
+                except re.error, e:
+                    self.write_message('bad pattern: %s' % e)
+                    return
+
                 self.filename = fullpath
-                self._request_income()
+                self.subscribe(since = since or None, resume = resume)
             else:
                 self.write_message('no filename')
         except IOError, e:
             log(str(e))
 
     def on_message(self, msg):
+        """\
+        {"include": pattern, "exclude": pattern} replaces the line filter of
+        this viewer, an empty or missing pattern removes that half of it.
+        """
         log("get msg: %s" % msg)
+        try:
+            request = json_decode(msg)
+        except ValueError:
+            return
+        if not isinstance(request, dict):
+            return
+
+        if 'include' in request or 'exclude' in request:
+            try:
+                self.set_filter(request.get('include'), request.get('exclude'))
+            except re.error, e:
+                self.write_message('bad pattern: %s\n' % e)
+
+
+
 
+class MergeSource(TailSubscriberMixin):
+    """\
+    Subscriber of one of the files of a WSMergeHandler, handing the lines
+    of the file to the handler's merger.
+    """
+    def __init__(self, handler, filename):
+        self.handler = handler
+        self.settings = handler.settings
+        self.filename = filename
+        self.tag = utf8('[%s] ' % os.path.relpath(filename, self.settings['basic_path']))
+        self.parser = TimestampParser(self.file_setting('time_format', DEFAULT_TIME_FORMAT))
 
+    def on_line(self, line):
+        self.on_lines([line])
+
+    def on_lines(self, lines, batch = None):
+        self.handler.on_source_lines(self, lines)
+
+    def on_frame(self, payload, frames):
+        self.on_lines(payload.split('\n')[:-1])
+
+    def unsubscribe(self):
+        TailSubscriberMixin.unsubscribe(self)
+        merger = getattr(self.handler, 'merger', None)
+        if merger is not None:
+            merger.forget(self)
+
+    def disconnect(self):
+        self.handler.disconnect()
+
+
+class WSMergeHandler(QueuedOutputMixin, websocket.WebSocketHandler):
+    """\
+    /websocket/merge?files=a.log,worker-*.log follows every listed file (or
+    glob match) and sends their lines as a single timeline, ordered by
+    timestamp within the merge window and prefixed with '[file] '.
+    """
+    tick_handle = None
+    sources = ()
+
+    def open(self):
+        log('ws merge incoming.. files = %s' % self.get_argument('files', ''))
+        basic_path = self.settings['basic_path']
+        paths = []
+        for name in self.get_argument('files', '').split(','):
+            name = name.strip()
+            if not name:
+                continue
+            fullpath = os.path.normpath(os.path.join(basic_path, name))
+            if not fullpath.startswith(basic_path):
+                self.write_message('".." is not allowed in filename\n')
+                return
+            for path in sorted(glob.glob(fullpath)):
+                if os.path.isfile(path) and path not in paths:
+                    paths.append(path)
+
+        if not paths:
+            self.write_message('no file matches\n')
+            return
+        max_files = self.settings.get('merge_max_files', MERGE_MAX_FILES)
+        if len(paths) > max_files:
+            self.write_message('more than %d files match\n' % max_files)
+            return
+
+        self.merger = TimelineMerger(self.settings.get('merge_window', MERGE_WINDOW),
+                                     self.settings.get('merge_max_pending', MERGE_MAX_PENDING))
+        self.started = False
+        # length of the longest backlog a file sent
+        self.backlog_lines = 0
+        try:
+            include = self.get_argument('include', None)
+            exclude = self.get_argument('exclude', None)
+            self.sources = [MergeSource(self, path) for path in paths]
+            for source in self.sources:
+                source.set_filter(include, exclude)
+                source.subscribe()
+        except re.error, e:
+            self.write_message('bad pattern: %s\n' % e)
+            self.on_close()
+            return
+        except IOError, e:
+            log(str(e))
+            self.write_message('%s\n' % e)
+            self.on_close()
+            return
+
+        # the backlogs of all files, merged and cut to the length of one,
+        # make up the backlog of the timeline
+        self.merger.trim(self.backlog_lines)
+        self.started = True
+        self.send(self.merger.ready(drain = True))
+        self.schedule_tick()
+
+    def on_source_lines(self, source, lines):
+        self.merger.push(source, source.parser, lines)
+        if self.started:
+            self.send(self.merger.ready())
+        else:
+            self.backlog_lines = max(self.backlog_lines, len(lines))
+
+    def schedule_tick(self):
+        self.tick_handle = ioloop.IOLoop.instance().add_timeout(
+                time.time() + self.merger.window, self.tick)
+
+    def tick(self):
+        self.send(self.merger.tick())
+        self.schedule_tick()
+
+    def send(self, entries):
+        if entries:
+            entries.append((None, ''))
+            self.send_frames(Frames('\n'.join([source.tag + line if source else line
+                                               for source, line in entries])))
+
+    def on_close(self):
+        if self.tick_handle is not None:
+            ioloop.IOLoop.instance().remove_timeout(self.tick_handle)
+            self.tick_handle = None
+        for source in self.sources:
+            source.unsubscribe()
+        self.sources = ()
 
     
     
-class TailHandler(tornado.web.RequestHandler, TailMixin):
+class TailHandler(tornado.web.RequestHandler, QueuedOutputMixin, TailSubscriberMixin):
+    """\
+    Chunked HTTP stream of a file, fed by the same inotify driven
+    TailFileClient as the WebSocket viewers.
+    """
     @tornado.web.asynchronous
     def get(self):
         try:
@@ -340,56 +1266,222 @@ class TailHandler(tornado.web.RequestHandler, TailMixin):
                     self.finish()
                     return
 
-                self.fd = open(fullpath, 'r')
-                self.read_size = 1024
-
-                lines = self.tail(10)
-                for line in lines:
-                    self.write(line)
-                    self.write('\n')
-                    self.flush()
+                try:
+                    self.set_filter(self.get_argument('include', None),
+                                    self.get_argument('exclude', None))
+                except re.error, e:
+                    self.write('bad pattern: %s' % e)
+                    self.finish()
+                    return
 
-                self.trailing = True       
-                self.follow()
+                self.filename = fullpath
+                self.subscribe()
             else:
                 self.write('no filename')
                 self.finish()
         except IOError, e:
             log(str(e))
+            self.finish()
+
+    def on_line(self, line):
+        self.on_lines([line])
 
+    def on_lines(self, lines, batch = None):
+        self.send_frames(Frames('\n'.join(lines) + '\n', lines))
 
-    def follow(self):
+    def on_frame(self, payload, frames):
+        self.send_frames(frames)
+
+    def output_stream(self):
+        stream = self.request.connection.stream
+        if stream.closed():
+            return None
+        return stream
+
+    def write_frames(self, frames, callback):
+        self.write(frames.payload)
+        self.flush(callback = callback)
+
+    def disconnect(self):
+        self.disconnected = True
+        self.request.connection.stream.close()
+
+    def on_connection_close(self):
+        log('client closed')
+        self.unsubscribe()
+        
+
+class LinesHandler(tornado.web.RequestHandler):
+    """\
+    /lines?filename=&from=&count= returns count lines starting at line from
+    (1 based), located through the sparse line index of the file.
+    """
+    @tornado.web.asynchronous
+    def get(self):
+        try:
+            filename = self.get_argument('filename', None)
+            if filename:
+                basic_path = self.settings['basic_path']
+                fullpath = os.path.normpath(os.path.join(basic_path, filename))
+                if not fullpath.startswith(basic_path):
+                    self.write('".." is not allowed in filename')
+                    self.finish()
+                    return
+
+                try:
+                    self.first = max(int(self.get_argument('from', 1)), 1) - 1
+                    self.count = min(int(self.get_argument('count', 100)), LINES_LIMIT)
+                except ValueError:
+                    self.write('from and count must be integers')
+                    self.finish()
+                    return
+
+                self.fullpath = fullpath
+                self.fd = open_log(fullpath)
+                self.index = get_index(fullpath, self.settings.get('index_step', INDEX_STEP),
+                                       self.settings.get('index_dir'))
+                self.build_index()
+            else:
+                self.write('no filename')
+                self.finish()
+        except IOError, e:
+            log(str(e))
+            self.finish()
+
+    def build_index(self):
+        """\
+        Catch the index up with the file INDEX_CHUNK bytes per IOLoop
+        iteration (once a compressed archive is indexed too), then serve the
+        requested lines.
+        """
         if self.request.connection.stream.closed():
             log('client closed')
+            self.fd.close()
             return
-        
-        while True:
-            where = self.fd.tell()
-            line = self.fd.readline()
-            if line:    
-                if self.trailing and line in self.line_terminators:
-                    # This is just the line terminator added to the end of the file
-                    # before a new line, ignore.
-                    trailing = False
-                    ioloop.IOLoop.instance().add_timeout(time.time() + 0.1, self.follow)
+
+        if not prepare(self.fullpath) or not self.index.update(self.fd):
+            ioloop.IOLoop.instance().add_callback(self.build_index)
+            return
+
+        self.index.save()
+        lines = self.index.read_lines(self.fd, self.first, self.count)
+        self.fd.close()
+        self.set_header('Content-Type', 'text/plain')
+        if lines:
+            self.write('\n'.join(lines))
+            self.write('\n')
+        self.finish()
+
+class SearchHandler(tornado.web.RequestHandler):
+    """\
+    /search?filename=&pattern=[&limit=] streams the lines of the whole file
+    matching the regular expression pattern, in file order, searched in
+    parallel by a pool of worker processes.
+    """
+    search = None
+
+    @tornado.web.asynchronous
+    def get(self):
+        try:
+            filename = self.get_argument('filename', None)
+            pattern = self.get_argument('pattern', None)
+            if filename and pattern:
+                basic_path = self.settings['basic_path']
+                fullpath = os.path.normpath(os.path.join(basic_path, filename))
+                if not fullpath.startswith(basic_path):
+                    self.write('".." is not allowed in filename')
+                    self.finish()
                     return
 
-                if line[-1] in self.line_terminators:
-                    line = line[:-1]
-                    if line[-1:] == '\r\n' and '\r\n' in self.line_terminators:
-                        # found crlf
-                        line = line[:-1]
+                search_limit = self.settings.get('search_limit', SEARCH_LIMIT)
+                try:
+                    limit = min(int(self.get_argument('limit', search_limit)), search_limit)
+                except ValueError:
+                    self.write('limit must be an integer')
+                    self.finish()
+                    return
 
-                self.trailing = False
-                self.write(line)
-                self.write('\n')
-                self.flush()
+                self.set_header('Content-Type', 'text/plain')
+                self.search = ParallelSearch(fullpath, pattern, limit,
+                                             self.on_lines, self.on_done,
+                                             ioloop.IOLoop.instance(),
+                                             self.settings.get('search_chunk', SEARCH_CHUNK),
+                                             self.settings.get('search_processes'))
+                try:
+                    self.search.start()
+                except re.error, e:
+                    self.write('bad pattern: %s' % e)
+                    self.finish()
             else:
-                self.trailing = True
-                self.seek(where)
-                ioloop.IOLoop.instance().add_timeout(time.time() + 0.1, self.follow)
-                break
-        
+                self.write('no filename or pattern')
+                self.finish()
+        except IOError, e:
+            log(str(e))
+            self.finish()
+
+    def on_lines(self, lines):
+        self.write('\n'.join(lines))
+        self.write('\n')
+        self.flush()
+
+    def on_done(self, message):
+        if message is not None:
+            self.write('-- %s --\n' % message)
+        self.finish()
+
+    def on_connection_close(self):
+        log('client closed')
+        if self.search is not None:
+            self.search.cancel()
+
+class FilesHandler(tornado.web.RequestHandler):
+    """\
+    /files returns the catalog of the files under basic_path as JSON:
+    {"files": [{"name", "size", "mtime", "rate"}, ...]}, rate being the
+    growth in bytes per second.
+    """
+    def get(self):
+        catalog = FileCatalog.instance(self.settings['basic_path'])
+        self.set_header('Content-Type', 'application/json')
+        self.write(json_encode({'files': catalog.listing()}))
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """\
+    /metrics returns counters of the followed files, of the inotify events
+    collapsed, of the output queues of slow viewers and of the WebSocket
+    compression as JSON.
+    """
+    def get(self):
+        metrics = output_queue.snapshot()
+        clients = TailSubscriberMixin.clients.values()
+        metrics['followed_files'] = len(clients)
+        metrics['viewers'] = sum(len(tfc.waiters) for tfc in clients)
+        metrics['collapsed_events'] = WatchRegistry.collapsed_events()
+        metrics['compression'] = compression_stats()
+        self.set_header('Content-Type', 'application/json')
+        self.write(json_encode(metrics))
+
+
+class WSFilesHandler(websocket.WebSocketHandler):
+    """\
+    Push channel of the catalog: {"files": [...]} on open, then
+    {"changed": [...], "removed": [names]} whenever it changes.
+    """
+    catalog = None
+
+    def open(self):
+        self.catalog = FileCatalog.instance(self.settings['basic_path'])
+        self.write_message(json_encode({'files': self.catalog.listing()}))
+        self.catalog.listen(self.on_catalog)
+
+    def on_catalog(self, changed, removed):
+        self.write_message(json_encode({'changed': changed, 'removed': removed}))
+
+    def on_close(self):
+        if self.catalog is not None:
+            self.catalog.unlisten(self.on_catalog)
+
 
 def main():
     app = Application()
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 
+import os
+
 import pyinotify
-from pyinotify import deque, _SysProcessEvent
+from pyinotify import deque, _SysProcessEvent, IN_MODIFY
 from tornado.ioloop import IOLoop
 
 class TornadoNotifier(pyinotify.Notifier):
@@ -62,12 +64,214 @@ class TornadoNotifier(pyinotify.Notifier):
         self._timeout = timeout
         # Coalesce events option
         self._coalesce = False
-        # set of str(raw_event), only used when coalesce option is True
+        # set of (wd, mask, cookie, name), only used when coalesce option is True
         self._eventset = set()
+        # Number of IN_MODIFY events dropped by coalesce_modify()
+        self.collapsed_events = 0
 
 
     def handle_tornado(self, fd, event):
         self.read_events()
+        self.coalesce_modify()
         self.process_events()
-        
-        
+
+    def coalesce_modify(self):
+        """
+        Keep only the first IN_MODIFY event of each watched file in the
+        event queue, see coalesce_modify_events().
+        """
+        kept = coalesce_modify_events(self._eventq)
+        self.collapsed_events += len(self._eventq) - len(kept)
+        self._eventq = kept
+
+
+def coalesce_modify_events(events):
+    """
+    Return the raw events without the IN_MODIFY events repeating an earlier
+    one of the same file: same watch and same name, as the files of a
+    watched directory share its watch.  Handlers read everything the file
+    holds when they run, so one modification per file and wake-up is
+    enough.
+
+    >>> from pyinotify import _RawEvent
+    >>> events = [_RawEvent(1, IN_MODIFY, 0, ''), _RawEvent(2, IN_MODIFY, 0, 'a.log'),
+    ...           _RawEvent(2, IN_MODIFY, 0, 'b.log'), _RawEvent(1, IN_MODIFY, 0, ''),
+    ...           _RawEvent(2, IN_MODIFY, 0, 'a.log')]
+    >>> [(e.wd, e.name) for e in coalesce_modify_events(events)]
+    [(1, ''), (2, 'a.log'), (2, 'b.log')]
+    """
+    seen = set()
+    kept = deque()
+    for raw_event in events:
+        if raw_event.mask == IN_MODIFY:
+            key = (raw_event.wd, raw_event.name)
+            if key in seen:
+                continue
+            seen.add(key)
+        kept.append(raw_event)
+    return kept
+
+
+class _Dispatcher(pyinotify.ProcessEvent):
+    def my_init(self, registry):
+        self.registry = registry
+
+    def process_default(self, event):
+        self.registry.dispatch(event)
+
+
+class WatchRegistry(object):
+    """
+    Process wide inotify instance. A single WatchManager and TornadoNotifier,
+    hence a single inotify fd and IOLoop handler, are shared by every watched
+    path; events of a watch descriptor are dispatched to the callbacks
+    subscribed to it.
+    """
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(IOLoop.instance())
+        return cls._instance
+
+    @classmethod
+    def collapsed_events(cls):
+        """
+        IN_MODIFY events dropped by the notifier, without creating the
+        instance if nothing was watched yet.
+        """
+        if cls._instance is None:
+            return 0
+        return cls._instance.notifier.collapsed_events
+
+    def __init__(self, io_loop):
+        self.watch_manager = pyinotify.WatchManager()
+        self.notifier = TornadoNotifier(self.watch_manager,
+                                        _Dispatcher(registry = self),
+                                        io_loop = io_loop)
+        # wd -> {callback: mask}
+        self.subscribers = {}
+        # wd -> mask of the inotify watch, union of the subscribers' masks
+        self.masks = {}
+        # wd -> inode of the watched path when the watch was added
+        self.inodes = {}
+        # wd -> {callback: mask} of the recursive subscriptions, passed on
+        # to the directories created below it
+        self.trees = {}
+
+    def add(self, path, callback, mask):
+        """
+        Call callback(event) for the events of path matching mask.
+
+        @return: watch descriptor of path, needed by remove().
+        @rtype: int
+        @raise WatchManagerError: path cannot be watched.
+        """
+        wm = self.watch_manager
+        path = os.path.normpath(path)
+        try:
+            ino = os.stat(path).st_ino
+        except OSError:
+            ino = None
+        wd = wm.get_wd(path)
+        if wd is not None and self.inodes.get(wd, ino) != ino:
+            # The path names another file than when it was watched (a
+            # rotated log deleted while still open): the kernel gives the
+            # new file a watch of its own, the old one keeps its wd.
+            wm.get_watch(wd).path += '-unknown-path'
+            wd = None
+
+        if wd is None:
+            # IN_MASK_ADD in case the inode is watched under another path
+            wd = wm.add_watch(path, mask | pyinotify.IN_MASK_ADD, quiet = False)[path]
+            self.masks[wd] = self.masks.get(wd, 0) | mask
+            self.inodes[wd] = ino
+        elif mask & ~self.masks[wd]:
+            self.masks[wd] |= mask
+            wm.update_watch(wd, self.masks[wd], quiet = False)
+        self.subscribers.setdefault(wd, {})[callback] = mask
+        return wd
+
+    def add_tree(self, path, callback, mask):
+        """
+        Call callback(event) for the events matching mask of path and of
+        every directory below it, including the ones created later.
+
+        @return: watch descriptors of the directories, needed by remove().
+        @rtype: list of int
+        @raise WatchManagerError: path cannot be watched.
+        """
+        wm = self.watch_manager
+        path = os.path.normpath(path)
+        wm.add_watch(path, mask | pyinotify.IN_MASK_ADD, rec = True,
+                     auto_add = True, quiet = False)
+        # add_watch() skips the directories already watched (by a tail
+        # follower), pick up all of them from the WatchManager
+        prefix = path.rstrip(os.sep) + os.sep
+        wds = []
+        for wd, watch in wm.watches.items():
+            if watch.path == path or watch.path.startswith(prefix):
+                if os.path.isdir(watch.path):
+                    watch.auto_add = True
+                    wds.append(self.subscribe_tree(wd, callback, mask))
+        return wds
+
+    def subscribe_tree(self, wd, callback, mask):
+        self.masks.setdefault(wd, 0)
+        if mask & ~self.masks[wd]:
+            self.masks[wd] |= mask
+            self.watch_manager.update_watch(wd, self.masks[wd], quiet = False)
+        self.subscribers.setdefault(wd, {})[callback] = mask
+        self.trees.setdefault(wd, {})[callback] = mask
+        return wd
+
+    def remove(self, wd, callback):
+        """
+        Unsubscribe callback from wd, the watch is removed with its last
+        subscriber.
+        """
+        subscribers = self.subscribers.get(wd)
+        if subscribers is None:
+            return
+        subscribers.pop(callback, None)
+        tree = self.trees.get(wd)
+        if tree is not None:
+            tree.pop(callback, None)
+            if not tree:
+                del self.trees[wd]
+        if not subscribers:
+            del self.subscribers[wd]
+            del self.masks[wd]
+            self.inodes.pop(wd, None)
+            self.watch_manager.rm_watch(wd)
+
+    def dispatch(self, event):
+        tree = self.trees.get(event.wd)
+        if tree and event.mask & pyinotify.IN_CREATE and event.dir:
+            # pyinotify auto added a watch on the new directory
+            wd = self.watch_manager.get_wd(event.pathname)
+            if wd is not None:
+                for callback, mask in tree.items():
+                    self.subscribe_tree(wd, callback, mask)
+
+        subscribers = self.subscribers.get(event.wd)
+        if subscribers:
+            for callback, mask in subscribers.items():
+                if event.mask & mask:
+                    callback(event)
+
+        if event.mask & pyinotify.IN_IGNORED:
+            # the kernel dropped the watch (file deleted, fs unmounted)
+            self.subscribers.pop(event.wd, None)
+            self.masks.pop(event.wd, None)
+            self.inodes.pop(event.wd, None)
+            self.trees.pop(event.wd, None)
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == '__main__':
+    _test()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""\
+Prebuilt WebSocket (RFC 6455) frames, so a message broadcast to many
+connections is framed once and the same string is written to every stream.
+
+Connections which negotiated permessage-deflate (RFC 7692) can be sent a
+frame compressed once for all of them which use the same window size.
+Such a frame is compressed with a fresh context, and so has to be every
+other message of those connections: share_frames() makes their compressor
+start over with each message.
+
+Viewers asking for the binary protocol get each batch of lines as a binary
+message: a BATCH_HEADER, the length of every line as a 32 bit unsigned
+int, then the bytes of the lines, all in network byte order.  The header
+holds the id of the followed file, the number of the broadcast batch, the
+[start, end) byte range of the file the lines come from, the number of
+lines and the number of lines dropped before them for a slow viewer.
+Messages which are not lines of the file (errors, notices) stay text.
+"""
+
+import os
+import time
+import zlib
+import struct
+from collections import namedtuple
+
+from tornado import websocket
+from tornado.escape import utf8
+
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+
+FIN = 0x80
+RSV1 = 0x40
+
+# file id, batch number, start offset, end offset, line count, lines skipped
+BATCH_HEADER = struct.Struct('!IIQQII')
+
+# where a batch of lines comes from; seq is 0 for history which was never
+# broadcast
+Batch = namedtuple('Batch', 'file_id seq start end')
+
+def file_id(file, truncations = 0):
+    """\
+    Id of an open file in batch headers: the low 32 bits of its inode,
+    mixed with the number of times it was truncated in place since it was
+    opened, so it changes when the log is rotated or copytruncated but not
+    when the server restarts.
+    """
+    ino = os.fstat(file.fileno()).st_ino
+    return (ino ^ (truncations * 0x9E3779B1)) & 0xFFFFFFFF
+
+# what Z_SYNC_FLUSH appends, left out of permessage-deflate messages
+SYNC_TAIL = '\x00\x00\xff\xff'
+
+# totals since the server started
+compression = {
+    'messages': 0,          # messages compressed
+    'frames_reused': 0,     # writes of a frame compressed for another one
+    'bytes_in': 0,          # payload bytes sent compressed
+    'bytes_out': 0,         # frame bytes they took
+    'cpu_seconds': 0.0,     # spent compressing
+}
+
+def build_frame(payload, opcode=OPCODE_TEXT, flags=0):
+    """\
+    Return a complete, unmasked server to client frame for payload, UTF-8
+    encoded if it is unicode.
+
+    >>> build_frame('hi')
+    '\\x81\\x02hi'
+    >>> build_frame(u'\\xe9')
+    '\\x81\\x02\\xc3\\xa9'
+    >>> len(build_frame('x' * 200))
+    204
+    """
+    payload = utf8(payload)
+    first = FIN | flags | opcode
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('BB', first, length)
+    elif length <= 0xFFFF:
+        header = struct.pack('!BBH', first, 126, length)
+    else:
+        header = struct.pack('!BBQ', first, 127, length)
+    return header + payload
+
+def encode_batch(batch, lines, skipped = 0):
+    """\
+    Return the binary message of lines from batch.
+
+    >>> data = encode_batch(Batch(1, 7, 100, 112), ['abc', 'de'])
+    >>> BATCH_HEADER.unpack(data[:BATCH_HEADER.size]), data[BATCH_HEADER.size:]
+    ((1, 7, 100, 112, 2, 0), '\\x00\\x00\\x00\\x03\\x00\\x00\\x00\\x02abcde')
+    """
+    return ''.join([BATCH_HEADER.pack(batch.file_id, batch.seq, batch.start, batch.end,
+                                      len(lines), skipped),
+                    struct.pack('!%dI' % len(lines), *map(len, lines))] + lines)
+
+def deflate(payload, compressor = None, wbits = zlib.MAX_WBITS):
+    """\
+    Return payload compressed as a permessage-deflate message, with the
+    negotiated compressor of a connection or else a fresh context with a
+    window of 2 ** wbits bytes.
+
+    >>> data = deflate('hello hello hello\\n')
+    >>> zlib.decompressobj(-zlib.MAX_WBITS).decompress(data + SYNC_TAIL)
+    'hello hello hello\\n'
+    """
+    start = time.clock()
+    if compressor is None:
+        c = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -wbits)
+        data = c.compress(payload) + c.flush(zlib.Z_SYNC_FLUSH)
+        data = data[:-len(SYNC_TAIL)]
+    else:
+        # tornado strips the tail itself
+        data = compressor.compress(payload)
+    compression['messages'] += 1
+    compression['cpu_seconds'] += time.clock() - start
+    return data
+
+def count_compressed(payload, frame):
+    compression['bytes_in'] += len(payload)
+    compression['bytes_out'] += len(frame)
+
+def compression_stats():
+    stats = dict(compression)
+    stats['bytes_saved'] = stats['bytes_in'] - stats['bytes_out']
+    return stats
+
+
+class Frames(object):
+    """\
+    A message of newline terminated lines and its frames, each built the
+    first time a connection asks for it.  Without a batch the message can
+    only be sent as text.  Unicode payload and lines are UTF-8 encoded.
+
+    >>> frames = Frames('hi\\n')
+    >>> frames.get()
+    '\\x81\\x03hi\\n'
+    >>> frames.get(deflated = True) is frames.get(deflated = True)
+    True
+    >>> frames.get(deflated = True) is frames.get(deflated = True, wbits = 9)
+    False
+    >>> frame = Frames('hi\\n', ['hi'], Batch(1, 1, 0, 3)).get(binary = True)
+    >>> frame[0] == chr(FIN | OPCODE_BINARY), len(frame) == 2 + BATCH_HEADER.size + 4 + 2
+    (True, True)
+    """
+    def __init__(self, payload, lines = None, batch = None, skipped = 0):
+        self.payload = utf8(payload)
+        if lines is not None:
+            lines = [utf8(line) for line in lines]
+        self.lines = lines
+        self.batch = batch
+        self.skipped = skipped
+        # (binary, window bits if deflated else None) -> frame
+        self.built = {}
+
+    def data(self, binary = False):
+        """\
+        Return (opcode, message) for the text or binary protocol.
+        """
+        if binary and self.batch is not None:
+            return OPCODE_BINARY, encode_batch(self.batch, self.lines, self.skipped)
+        return OPCODE_TEXT, self.payload
+
+    def get(self, binary = False, deflated = False, wbits = zlib.MAX_WBITS):
+        """\
+        Return the frame of the message, compressed with a window of 2 **
+        wbits bytes if deflated.
+        """
+        key = (binary and self.batch is not None, wbits if deflated else None)
+        frame = self.built.get(key)
+        if frame is None:
+            opcode, data = self.data(binary)
+            if deflated:
+                frame = build_frame(deflate(data, wbits = wbits), opcode, RSV1)
+            else:
+                frame = build_frame(data, opcode)
+            self.built[key] = frame
+        elif deflated:
+            compression['frames_reused'] += 1
+        return frame
+
+
+def frame_stream(handler):
+    """\
+    Return the IOStream a prebuilt frame can be written to for a
+    WebSocketHandler, or None if the connection does not speak RFC 6455
+    framing or is already closed.
+    """
+    conn = getattr(handler, 'ws_connection', None)
+    if not isinstance(conn, websocket.WebSocketProtocol13):
+        return None
+    if conn.client_terminated or conn.stream.closed():
+        return None
+    return conn.stream
+
+def connection_compressor(handler):
+    """\
+    Return the permessage-deflate compressor of the connection of handler,
+    None if the browser did not negotiate compression.
+    """
+    return getattr(getattr(handler, 'ws_connection', None), '_compressor', None)
+
+def window_bits(compressor):
+    """\
+    Window size the client agreed to for messages of compressor, as a
+    power of two.
+    """
+    return getattr(compressor, '_max_wbits', zlib.MAX_WBITS)
+
+def share_frames(handler):
+    """\
+    Make the connection of handler compress every message with a fresh
+    context, so frames compressed once for all connections can be mixed
+    with its own messages.  Return False if the connection does not
+    compress.
+    """
+    compressor = connection_compressor(handler)
+    if compressor is None:
+        return False
+    # tornado's _PerMessageDeflateCompressor creates a compressor per
+    # message when it has none
+    compressor._compressor = None
+    return True
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == '__main__':
+    _test()